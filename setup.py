@@ -39,8 +39,11 @@ setup(
     include_package_data=True,
     zip_safe=False,
 
+    python_requires='>=3.8',
+
     install_requires=[
         'django-etc>=1.2.0',
+        'asgiref',
     ],
     setup_requires=[] + (['pytest-runner'] if 'test' in sys.argv else []),
 
@@ -56,11 +59,10 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
         'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'License :: OSI Approved :: BSD License'
     ],
 )
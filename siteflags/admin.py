@@ -1,9 +1,74 @@
+from typing import Optional
+
 from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.db.models.query import QuerySet
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
 
+from . import settings
+from .models import load_linked_objects
 from .utils import get_flag_model
 
 FLAG_MODEL = get_flag_model()
 
+ESTIMATE_THRESHOLD = 100000
+"""Tables with more rows than estimated are not counted exactly in admin."""
+
+
+def get_estimated_count(queryset: QuerySet) -> Optional[int]:
+    """Returns estimated number of rows for a queryset of a whole table
+    using DB statistics, if supported by DB. Otherwise returns None.
+
+    :param queryset:
+
+    """
+    if queryset.query.where:
+        return None  # Filtered.
+
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)'
+
+    elif connection.vendor == 'mysql':
+        sql = 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s'
+
+    else:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+
+    return row[0] if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Uses DB estimates instead of exact counting for whole huge tables."""
+
+    @cached_property
+    def count(self) -> int:
+        estimate = get_estimated_count(self.object_list)
+
+        if estimate is None or estimate < ESTIMATE_THRESHOLD:
+            return super().count
+
+        return estimate
+
+
+class FlagChangeList(ChangeList):
+    """Fetches objects linked to flags of a page with a query per objects type."""
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_list = load_linked_objects(list(self.result_list))
+
 
 @admin.register(FLAG_MODEL)
 class FlagModelAdmin(admin.ModelAdmin):
@@ -12,15 +77,25 @@ class FlagModelAdmin(admin.ModelAdmin):
         'time_created',
         'content_type',
         'object_id',
+        'linked_object_display',
+        'user',
         'status',
     )
 
-    search_fields = (
-        'object_id',
+    list_select_related = (
+        'user',
         'content_type',
+    )
+
+    raw_id_fields = (
         'user',
     )
 
+    # Enables search box. Lookups are defined by get_search_results().
+    search_fields = (
+        'object_id',
+    )
+
     list_filter = (
         'time_created',
         'status',
@@ -31,4 +106,32 @@ class FlagModelAdmin(admin.ModelAdmin):
         '-time_created',
     )
 
-    date_hierarchy = 'time_created'
+    date_hierarchy = 'time_created' if settings.ADMIN_DATE_HIERARCHY else None
+
+    paginator = EstimatedCountPaginator
+
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return FlagChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # Only lookups able to use indexes: object ID or username prefix.
+        search_term = search_term.strip()
+
+        if not search_term:
+            return queryset, False
+
+        lookup = Q(**{f'user__{get_user_model().USERNAME_FIELD}__startswith': search_term})
+
+        if search_term.isdigit():
+            # Usernames may consist of digits as well.
+            lookup |= Q(object_id=int(search_term))
+
+        return queryset.filter(lookup), False
+
+    def linked_object_display(self, flag) -> str:
+        linked_object = flag.linked_object
+        return '' if linked_object is None else f'{linked_object}'
+
+    linked_object_display.short_description = _('Object')
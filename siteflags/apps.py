@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.models.signals import post_migrate, pre_delete
 from django.utils.translation import gettext_lazy as _
 
 
@@ -7,3 +9,25 @@ class SiteflagsConfig(AppConfig):
 
     name = 'siteflags'
     verbose_name = _('Site Flags')
+    default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from . import settings
+        from .models import ModelWithFlag, remove_object_flags, remove_user_flags
+        from .utils import warm_content_types_on_request, clear_content_types, WARM_DISPATCH_UID
+
+        # Content types may be (re)created by migrations with other IDs.
+        post_migrate.connect(clear_content_types, dispatch_uid='siteflags_clear_content_types')
+
+        # Deletion cascades bypass siteflags API, so counters and cache need a hand.
+        for model in self.apps.get_models():
+            if issubclass(model, ModelWithFlag):
+                pre_delete.connect(
+                    remove_object_flags, sender=model, dispatch_uid=f'siteflags_remove_flags_{model._meta.label}')
+
+        pre_delete.connect(remove_user_flags, sender=get_user_model(), dispatch_uid='siteflags_remove_user_flags')
+
+        if settings.WARM_CONTENT_TYPES:
+            # Not querying DB on application start.
+            request_started.connect(warm_content_types_on_request, dispatch_uid=WARM_DISPATCH_UID)
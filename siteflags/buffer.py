@@ -0,0 +1,217 @@
+import atexit
+from collections import defaultdict
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional, Tuple, Callable, Iterable
+
+from django.db import transaction
+
+from . import settings
+from .cache import invalidate_flags_cache
+from .utils import get_flag_model
+
+if False:  # pragma: nocover
+    from .models import FlagBase  # noqa
+
+
+class FlagsBuffer:
+    """Collects flags to write them later in bulk (write-behind).
+
+    Flags are written when their number reaches SITEFLAGS_BUFFER_SIZE
+    or the oldest of them is older than SITEFLAGS_BUFFER_TIMEOUT.
+
+    """
+    def __init__(self):
+        self._flags: Dict[Tuple, 'FlagBase'] = {}
+        self._started: Optional[float] = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._flags)
+
+    def add(self, flag: 'FlagBase', *, flush: bool = True):
+        """Adds a flag to buffer. Duplicates are ignored.
+
+        :param flag: Flag object (not saved).
+        :param flush: Write buffered flags if buffer size threshold is reached.
+            Time threshold is checked by `FlagsBufferMiddleware` and `flush_flags_buffer()`.
+
+        """
+        with self._lock:
+            if not self._flags:
+                self._started = monotonic()
+
+            self._flags.setdefault((flag.content_type_id, flag.object_id, flag.user_id, flag.status), flag)
+
+        if flush and self.is_full():
+            self.flush()
+
+    def discard(
+            self,
+            content_type_id: int,
+            objects_ids: Iterable[int],
+            *,
+            user_id: Optional[int] = None,
+            status: Optional[int] = None
+
+    ) -> int:
+        """Drops buffered (not yet written) flags of the given objects.
+        Returns a number of flags dropped.
+
+        :param content_type_id:
+        :param objects_ids:
+        :param user_id: Optional user filter.
+        :param status: Optional status filter.
+
+        """
+        if not self._flags:
+            return 0
+
+        objects_ids = set(objects_ids)
+
+        with self._lock:
+            keys = [
+                key for key in self._flags
+                if key[0] == content_type_id and key[1] in objects_ids
+                and (user_id is None or key[2] == user_id)
+                and (status is None or key[3] == status)
+            ]
+
+            for key in keys:
+                del self._flags[key]
+
+            if not self._flags:
+                self._started = None
+
+        return len(keys)
+
+    def is_full(self) -> bool:
+        """Whether buffer size threshold is reached."""
+        return len(self._flags) >= settings.BUFFER_SIZE
+
+    def is_due(self) -> bool:
+        """Whether buffered flags are to be written."""
+        started = self._started
+
+        if started is None:
+            return False
+
+        return self.is_full() or monotonic() - started >= settings.BUFFER_TIMEOUT
+
+    def clear(self):
+        """Drops buffered flags without writing them."""
+        with self._lock:
+            self._flags = {}
+            self._started = None
+
+    def flush(self) -> int:
+        """Writes buffered flags. Returns a number of flags written."""
+        with self._lock:
+            flags = list(self._flags.values())
+            self._flags = {}
+            self._started = None
+
+        if not flags:
+            return 0
+
+        return write_flags(flags)
+
+
+_BUFFER = FlagsBuffer()
+
+
+def get_flags_buffer() -> FlagsBuffer:
+    """Returns flags buffer of the process."""
+    return _BUFFER
+
+
+def flush_flags_buffer(*, force: bool = True) -> int:
+    """Writes flags from process buffer. Returns a number of flags written.
+
+    :param force: Write even if buffer thresholds are not reached.
+
+    """
+    if force or _BUFFER.is_due():
+        return _BUFFER.flush()
+
+    return 0
+
+
+def write_flags(flags: List['FlagBase']) -> int:
+    """Writes the given flags in bulk skipping existing ones.
+    Returns a number of flags written.
+
+    :param flags: Flags objects (not saved).
+
+    """
+    from .models import FlagCounter
+
+    if settings.COUNTERS:
+        # Counters are only to be updated for flags actually inserted.
+        flags = exclude_existing(flags)
+
+    with transaction.atomic():
+        get_flag_model().objects.bulk_create(flags, ignore_conflicts=True)
+
+        if settings.COUNTERS:
+            FlagCounter.count_flags(flags)
+
+    # Invalidate by users not to affect cached entries of other users.
+    objects_by_user = defaultdict(set)
+
+    for flag in flags:
+        objects_by_user[(flag.content_type_id, flag.user_id)].add(flag.object_id)
+
+    for (content_type_id, user_id), objects_ids in objects_by_user.items():
+        invalidate_flags_cache(content_type_id, list(objects_ids), user_id=user_id)
+
+    return len(flags)
+
+
+def exclude_existing(flags: List['FlagBase']) -> List['FlagBase']:
+    """Returns those of the given flags which are not yet in DB.
+
+    :param flags:
+
+    """
+    grouped = defaultdict(list)
+
+    for flag in flags:
+        grouped[(flag.content_type_id, flag.status)].append(flag)
+
+    result = []
+    flag_model = get_flag_model()
+
+    for (content_type_id, status), flags_group in grouped.items():
+
+        existing = set(flag_model.objects.filter(
+            content_type_id=content_type_id,
+            object_id__in={flag.object_id for flag in flags_group},
+            user_id__in={flag.user_id for flag in flags_group},
+            **({'status__isnull': True} if status is None else {'status': status}),
+        ).values_list('object_id', 'user_id'))
+
+        result.extend(flag for flag in flags_group if (flag.object_id, flag.user_id) not in existing)
+
+    return result
+
+
+class FlagsBufferMiddleware:
+    """Writes buffered flags at the end of a request if buffer thresholds are reached.
+
+    Use SITEFLAGS_BUFFER_TIMEOUT = 0 to write them at the end of every request.
+
+    """
+    def __init__(self, get_response: Callable):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+
+        finally:
+            flush_flags_buffer(force=False)
+
+
+# Try not to lose buffered flags on graceful shutdown.
+atexit.register(flush_flags_buffer)
@@ -0,0 +1,273 @@
+from array import array
+from bisect import bisect_left
+from typing import Optional, Dict, Sequence, Any, Hashable, Union, Iterable, List
+from uuid import uuid4
+
+from django.core.cache import caches, BaseCache
+
+from siteflags import settings
+
+KEY_PREFIX = 'siteflags'
+
+SCOPE_GLOBAL = 'g'
+SCOPE_USERS = 'u'
+
+IDS_MEMO_SIZE = 512
+"""Max number of objects IDs sets memoized by a process."""
+
+_IDS_MEMO: Dict[str, 'ObjectsIds'] = {}
+
+
+class ObjectsIds:
+    """Compact set of objects IDs: a sorted array of unsigned integers."""
+
+    __slots__ = ('ids',)
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self.ids = array('I', sorted(set(ids)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, object_id: int) -> bool:
+        ids = self.ids
+        idx = bisect_left(ids, object_id)
+        return idx < len(ids) and ids[idx] == object_id
+
+    def __getstate__(self):
+        # Much more compact than pickled array.
+        return self.ids.tobytes()
+
+    def __setstate__(self, state: bytes):
+        self.ids = array('I')
+        self.ids.frombytes(state)
+
+    def filter(self, objects_ids: Iterable[int]) -> List[int]:
+        """Returns those of the given IDs which are in the set (preserving order).
+
+        :param objects_ids:
+
+        """
+        return [object_id for object_id in objects_ids if object_id in self]
+
+
+class FlagsCache:
+    """Caches flags lookups results under versioned keys.
+
+    Every cached entry key includes versions of scopes (an object, a user,
+    a content type) the entry depends on. Flags modification replaces
+    versions of affected scopes, so that stale entries are never read again
+    and just expire.
+
+    Versions expire along with entries: an expired version is replaced
+    with a new one, so that entries depending on it are not read again.
+
+    """
+    def __init__(self, cache: BaseCache, *, timeout: Optional[int]):
+        self.cache = cache
+        self.timeout = timeout
+
+    @classmethod
+    def _make_key(cls, *parts: Any) -> str:
+        return ':'.join([KEY_PREFIX, *map(str, parts)])
+
+    @classmethod
+    def _make_status(cls, status: Union[int, Sequence[int], None]) -> str:
+        if status is None:
+            return '-'
+
+        if isinstance(status, int):
+            return f'{status}'
+
+        return ','.join(map(str, sorted(status)))
+
+    def get_versions(self, scopes: Sequence[str]) -> Dict[str, str]:
+        """Returns a dictionary of versions indexed by the given scopes.
+
+        :param scopes:
+
+        """
+        cache = self.cache
+        keys = {self._make_key('v', scope): scope for scope in scopes}
+        versions = cache.get_many(keys)
+
+        missing = {key: uuid4().hex for key in keys if key not in versions}
+
+        if missing:
+            # Overwriting a version set concurrently is safe: entries under a replaced version
+            # are just never read again (that's how invalidation works).
+            cache.set_many(missing, self.timeout)
+            versions.update(missing)
+
+        return {keys[key]: version for key, version in versions.items()}
+
+    def get_objects_keys(
+            self,
+            kind: str,
+            content_type_id: int,
+            objects_ids: Sequence[int],
+            *,
+            user_id: Optional[int],
+            status: Union[int, Sequence[int], None]
+
+    ) -> Dict[int, str]:
+        """Returns a dictionary of cache keys for the given objects indexed by objects IDs.
+
+        :param kind: Entry kind (e.g. flags, count).
+        :param content_type_id:
+        :param objects_ids:
+        :param user_id:
+        :param status:
+
+        """
+        scopes = {object_id: f'o.{content_type_id}.{object_id}' for object_id in objects_ids}
+        versions = self.get_versions([SCOPE_GLOBAL, *scopes.values()])
+        version_global = versions[SCOPE_GLOBAL]
+        status = self._make_status(status)
+
+        return {
+            object_id: self._make_key(
+                kind, content_type_id, object_id, version_global, versions[scope], user_id or '-', status)
+            for object_id, scope in scopes.items()
+        }
+
+    def get_types_key(
+            self,
+            kind: str,
+            content_types_ids: Sequence[int],
+            *,
+            user_id: Optional[int],
+            status: Union[int, Sequence[int], None]
+
+    ) -> str:
+        """Returns a cache key for the given content types.
+
+        :param kind: Entry kind (e.g. flags, ids).
+        :param content_types_ids:
+        :param user_id:
+        :param status:
+
+        """
+        if user_id:
+            # Any user flags modification bumps this user version.
+            scopes = [SCOPE_USERS, f'u.{user_id}']
+
+        else:
+            scopes = [f't.{content_type_id}' for content_type_id in content_types_ids]
+
+        versions = self.get_versions([SCOPE_GLOBAL, *scopes])
+
+        return self._make_key(
+            kind,
+            ','.join(map(str, content_types_ids)),
+            '.'.join(versions[scope] for scope in [SCOPE_GLOBAL, *scopes]),
+            user_id or '-',
+            self._make_status(status),
+        )
+
+    def get_ids(self, key: str) -> Optional[ObjectsIds]:
+        """Returns a cached set of objects IDs. Sets are also memoized
+        by the process since their keys change on any flags modification.
+
+        :param key:
+
+        """
+        ids = _IDS_MEMO.get(key)
+
+        if ids is None:
+            ids = self.cache.get(key)
+
+            if ids is not None:
+                remember_ids(key, ids)
+
+        return ids
+
+    def set_ids(self, key: str, ids: ObjectsIds):
+        """Caches a set of objects IDs.
+
+        :param key:
+        :param ids:
+
+        """
+        self.cache.set(key, ids, self.timeout)
+        remember_ids(key, ids)
+
+    def get(self, key: str) -> Any:
+        return self.cache.get(key)
+
+    def get_many(self, keys: Dict[Hashable, str]) -> Dict[Hashable, Any]:
+        """Returns cached values for the given keys.
+
+        :param keys: Cache keys indexed by arbitrary hashables (e.g. objects IDs).
+            Values are returned indexed by the same hashables.
+
+        """
+        values = self.cache.get_many(list(keys.values()))
+        return {index: values[key] for index, key in keys.items() if key in values}
+
+    def set(self, key: str, value: Any):
+        self.cache.set(key, value, self.timeout)
+
+    def set_many(self, values: Dict[str, Any]):
+        self.cache.set_many(values, self.timeout)
+
+    def invalidate(self, content_type_id: int, objects_ids: Sequence[int], *, user_id: Optional[int]):
+        """Invalidates cached entries affected by flags modification.
+
+        :param content_type_id: Content type of the objects.
+        :param objects_ids: Objects which flags have been modified.
+        :param user_id: The user whose flags have been modified.
+            If not set, flags of an unknown set of users could be modified,
+            so that all users related entries are invalidated.
+
+        """
+        scopes = [f'o.{content_type_id}.{object_id}' for object_id in objects_ids]
+        scopes.append(f't.{content_type_id}')
+        scopes.append(f'u.{user_id}' if user_id else SCOPE_USERS)
+
+        self.cache.set_many({self._make_key('v', scope): uuid4().hex for scope in scopes}, self.timeout)
+
+    def invalidate_all(self):
+        """Invalidates all cached entries."""
+        self.cache.set(self._make_key('v', SCOPE_GLOBAL), uuid4().hex, self.timeout)
+
+
+def remember_ids(key: str, ids: ObjectsIds):
+    """Memoizes a set of objects IDs for the process.
+
+    :param key:
+    :param ids:
+
+    """
+    if len(_IDS_MEMO) >= IDS_MEMO_SIZE:
+        # Entries under outdated keys are never read, so it's safe to start over.
+        _IDS_MEMO.clear()
+
+    _IDS_MEMO[key] = ids
+
+
+def get_flags_cache() -> Optional[FlagsCache]:
+    """Returns flags cache object if caching is enabled
+    with SITEFLAGS_CACHE setting, or None.
+
+    """
+    alias = settings.CACHE
+
+    if not alias:
+        return None
+
+    return FlagsCache(caches[alias], timeout=settings.CACHE_TIMEOUT)
+
+
+def invalidate_flags_cache(content_type_id: int, objects_ids: Sequence[int], *, user_id: Optional[int]):
+    """Invalidates cached entries affected by flags modification if caching is enabled.
+
+    :param content_type_id: Content type of the objects.
+    :param objects_ids: Objects which flags have been modified.
+    :param user_id: The user whose flags have been modified.
+
+    """
+    flags_cache = get_flags_cache()
+
+    if flags_cache:
+        flags_cache.invalidate(content_type_id, objects_ids, user_id=user_id)
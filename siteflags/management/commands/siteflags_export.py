@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from siteflags.transfer import export_flags, FORMATS
+
+
+class Command(BaseCommand):
+
+    help = 'Exports all flags into a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='File to write flags into. Use "-" for standard output.')
+        parser.add_argument(
+            '--format', choices=FORMATS, default='csv', dest='fmt',
+            help='Output format.')
+        parser.add_argument(
+            '--chunk', type=int, default=5000, dest='chunk_size',
+            help='Number of flags to fetch from DB at once.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+
+        # Messages go to stderr not to mess with flags written into stdout.
+        def progress(exported: int):
+            self.stderr.write(f'Flags exported so far: {exported}')
+
+        def export(stream):
+            return export_flags(
+                stream,
+                fmt=options['fmt'],
+                chunk_size=options['chunk_size'],
+                progress=progress if options['verbosity'] > 1 else None,
+            )
+
+        if path == '-':
+            exported = export(sys.stdout)
+
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                exported = export(f)
+
+        if options['verbosity']:
+            self.stderr.write(f'Flags exported: {exported}')
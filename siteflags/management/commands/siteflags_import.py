@@ -0,0 +1,48 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from siteflags.transfer import import_flags, FORMATS
+
+
+class Command(BaseCommand):
+
+    help = 'Imports flags from a CSV or JSON Lines file (see siteflags_export), skipping existing ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='File to read flags from. Use "-" for standard input.')
+        parser.add_argument(
+            '--format', choices=FORMATS, default='csv', dest='fmt',
+            help='Input format.')
+        parser.add_argument(
+            '--chunk', type=int, default=5000, dest='chunk_size',
+            help='Number of flags to write at once.')
+        parser.add_argument(
+            '--copy', action='store_true',
+            help='Use COPY to pass flags into DB (PostgreSQL only).')
+
+    def handle(self, *args, **options):
+        path = options['path']
+
+        def progress(processed: int):
+            self.stdout.write(f'Flags processed so far: {processed}')
+
+        def import_(stream):
+            return import_flags(
+                stream,
+                fmt=options['fmt'],
+                chunk_size=options['chunk_size'],
+                copy=options['copy'],
+                progress=progress if options['verbosity'] > 1 else None,
+            )
+
+        if path == '-':
+            processed = import_(sys.stdin)
+
+        else:
+            with open(path, encoding='utf-8', newline='') as f:
+                processed = import_(f)
+
+        self.stdout.write(f'Flags processed: {processed}')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from siteflags.utils import get_flag_model
+
+
+class Command(BaseCommand):
+
+    help = 'Removes (or archives) flags expired according to SITEFLAGS_RETENTION setting.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk', type=int, default=1000, dest='chunk_size',
+            help='Number of flags to remove at once.')
+        parser.add_argument(
+            '--archive', action='store_true', default=None,
+            help='Move flags into archive (FlagArchive model) instead of just deleting them.')
+
+    def handle(self, *args, **options):
+
+        def progress(removed: int):
+            self.stdout.write(f'Flags removed so far: {removed}')
+
+        removed = get_flag_model().purge_expired(
+            archive=options['archive'],
+            chunk_size=options['chunk_size'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(f'Expired flags removed: {removed}')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from siteflags.models import FlagCounter
+
+
+class Command(BaseCommand):
+
+    help = 'Rebuilds denormalized flags counts (FlagCounter) from flags table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk', type=int, default=5000, dest='chunk_size',
+            help='Number of counters to insert at once.')
+
+    def handle(self, *args, **options):
+        created = FlagCounter.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(f'Counters rebuilt: {created}')
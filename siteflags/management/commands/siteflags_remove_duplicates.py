@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from siteflags.utils import get_flag_model
+
+
+class Command(BaseCommand):
+
+    help = 'Removes duplicate flags without status (keeping the oldest ones).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk', type=int, default=1000, dest='chunk_size',
+            help='Number of flags to delete at once.')
+
+    def handle(self, *args, **options):
+        removed = get_flag_model().remove_duplicates(chunk_size=options['chunk_size'])
+        self.stdout.write(f'Duplicates removed: {removed}')
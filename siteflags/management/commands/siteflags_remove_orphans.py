@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from siteflags.utils import get_flag_model
+
+
+class Command(BaseCommand):
+
+    help = 'Removes flags of objects which no longer exist.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk', type=int, default=1000, dest='chunk_size',
+            help='Number of flags to remove at once.')
+        parser.add_argument(
+            '--include-stale-types', action='store_true',
+            help='Also remove all flags of content types which models are not available '
+                 '(e.g. application is not installed). Use with care.')
+
+    def handle(self, *args, **options):
+
+        def progress(removed: int):
+            self.stdout.write(f'Flags removed so far: {removed}')
+
+        removed = get_flag_model().remove_orphans(
+            include_stale_types=options['include_stale_types'],
+            chunk_size=options['chunk_size'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(f'Orphaned flags removed: {removed}')
@@ -0,0 +1,237 @@
+import inspect
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from typing import Callable, Optional, List, Dict, Any, Iterator
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models import Model
+from django.db.models.query import QuerySet
+
+from .signals import sig_flags_operation, sig_flags_metrics_collected
+from .utils import get_content_type_id, get_content_types_ids
+
+_TRACKERS: ContextVar[tuple] = ContextVar('siteflags_trackers', default=())
+_NESTED: ContextVar[bool] = ContextVar('siteflags_nested', default=False)
+
+
+class FlagsMetrics:
+    """Totals for flags operations."""
+
+    def __init__(self):
+        self.operations: int = 0
+        self.queries: int = 0
+        self.rows: int = 0
+        self.duration: float = 0
+        self.by_operation: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
+            'calls': 0, 'queries': 0, 'rows': 0, 'duration': 0,
+        })
+
+    def __repr__(self):
+        return f'<FlagsMetrics operations={self.operations} queries={self.queries} duration={self.duration:.6f}>'
+
+    def add(self, *, operation: str, rows: Optional[int], queries: Optional[int], duration: float):
+        """Adds operation measurements to totals.
+
+        :param operation:
+        :param rows:
+        :param queries:
+        :param duration:
+
+        """
+        rows = rows or 0
+        queries = queries or 0
+
+        self.operations += 1
+        self.queries += queries
+        self.rows += rows
+        self.duration += duration
+
+        stats = self.by_operation[operation]
+        stats['calls'] += 1
+        stats['queries'] += queries
+        stats['rows'] += rows
+        stats['duration'] += duration
+
+
+@contextmanager
+def track_flags() -> Iterator[FlagsMetrics]:
+    """Context manager to sum up flags operations metrics.
+
+    .. code-block:: python
+
+        with track_flags() as metrics:
+            article.is_flagged(user)
+
+        print(metrics.duration, metrics.queries)
+
+    """
+    metrics = FlagsMetrics()
+    token = _TRACKERS.set(_TRACKERS.get() + (metrics,))
+
+    try:
+        yield metrics
+
+    finally:
+        _TRACKERS.reset(token)
+
+
+class FlagsMetricsMiddleware:
+    """Sums up flags operations metrics for every request.
+
+    Metrics are available as `request.siteflags_metrics`
+    and are sent with `sig_flags_metrics_collected` signal.
+
+    """
+    def __init__(self, get_response: Callable):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with track_flags() as metrics:
+            request.siteflags_metrics = metrics
+            response = self.get_response(request)
+
+        sig_flags_metrics_collected.send(sender=self.__class__, request=request, metrics=metrics)
+
+        return response
+
+
+def count_rows(result: Any) -> Optional[int]:
+    """Returns a number of rows in flags operation result.
+
+    :param result:
+
+    """
+    if result is None:
+        return 0
+
+    if isinstance(result, QuerySet):
+        return None  # Lazy. Do not evaluate.
+
+    if isinstance(result, bool):
+        return int(result)
+
+    if isinstance(result, int):
+        return result
+
+    if isinstance(result, dict):
+        return sum(len(value) if isinstance(value, (list, dict)) else 1 for value in result.values())
+
+    if isinstance(result, (list, tuple)):
+        return len(result)
+
+    return 1
+
+
+def get_content_types(subject: Any) -> List[int]:
+    """Returns IDs of content types for an operation subject.
+
+    :param subject: Model class or instance, or a sequence of those, or a QuerySet.
+
+    """
+    if subject is None:
+        return []
+
+    if isinstance(subject, QuerySet):
+        return [get_content_type_id(subject.model)]
+
+    if isinstance(subject, (type, Model)):
+        return [get_content_type_id(subject)]
+
+    types = {obj if isinstance(obj, type) else type(obj) for obj in subject}
+
+    return sorted(set(get_content_types_ids(types).values()))
+
+
+def instrumented(operation: str, *, subject: Optional[str] = 'self') -> Callable:
+    """Decorator for flags operations to report their metrics.
+
+    Metrics are collected only if there are `sig_flags_operation` signal receivers
+    or metrics are being tracked (see `track_flags()`).
+
+    :param operation: Operation name.
+    :param subject: Name of an argument operation deals with (objects or types),
+        to deduce content types from. None if those are not known in advance.
+
+    """
+    def decorator(func: Callable) -> Callable:
+
+        signature = inspect.signature(func)
+
+        def report(trackers: tuple, args: tuple, kwargs: dict, *, result: Any, queries: Optional[int], duration: float):
+            rows = count_rows(result)
+
+            for metrics in trackers:
+                metrics.add(operation=operation, rows=rows, queries=queries, duration=duration)
+
+            if sig_flags_operation.has_listeners():
+                sig_flags_operation.send(
+                    sender=args[0] if isinstance(args[0], type) else type(args[0]),
+                    operation=operation,
+                    content_types=get_content_types(signature.bind(*args, **kwargs).arguments.get(subject)),
+                    rows=rows,
+                    queries=queries,
+                    duration=duration,
+                )
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def awrapper(*args, **kwargs):
+                trackers = _TRACKERS.get()
+
+                if _NESTED.get() or not (trackers or sig_flags_operation.has_listeners()):
+                    return await func(*args, **kwargs)
+
+                token = _NESTED.set(True)
+                started = perf_counter()
+
+                try:
+                    result = await func(*args, **kwargs)
+
+                finally:
+                    duration = perf_counter() - started
+                    _NESTED.reset(token)
+
+                # Queries are issued from other threads and are not counted.
+                await sync_to_async(report)(trackers, args, kwargs, result=result, queries=None, duration=duration)
+
+                return result
+
+            return awrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            trackers = _TRACKERS.get()
+
+            if _NESTED.get() or not (trackers or sig_flags_operation.has_listeners()):
+                return func(*args, **kwargs)
+
+            queries = 0
+
+            def count_queries(execute, sql, params, many, context):
+                nonlocal queries
+                queries += 1
+                return execute(sql, params, many, context)
+
+            token = _NESTED.set(True)
+            started = perf_counter()
+
+            try:
+                with connection.execute_wrapper(count_queries):
+                    result = func(*args, **kwargs)
+
+            finally:
+                duration = perf_counter() - started
+                _NESTED.reset(token)
+
+            report(trackers, args, kwargs, result=result, queries=queries, duration=duration)
+
+            return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('siteflags', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='flag',
+            name='content_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(app_label)s_%(class)s_flags', to='contenttypes.contenttype', verbose_name='Content type'),
+        ),
+        migrations.AlterField(
+            model_name='flag',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_users', to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+        migrations.CreateModel(
+            name='FlagCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Object ID')),
+                ('status', models.IntegerField(blank=True, null=True, verbose_name='Status')),
+                ('count', models.IntegerField(default=0, verbose_name='Count')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype', verbose_name='Content type')),
+            ],
+            options={
+                'verbose_name': 'Flag counter',
+                'verbose_name_plural': 'Flag counters',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='flagcounter',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id', 'status'), name='siteflags_counter_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='flagcounter',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__isnull', True)), fields=('content_type', 'object_id'), name='siteflags_counter_uniq_nostatus'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('siteflags', '0002_flagcounter'),
+    ]
+
+    operations = [
+        # New indexes are created before superseded ones are dropped.
+        migrations.AddIndex(
+            model_name='flag',
+            index=models.Index(fields=['user', 'content_type', 'status', '-time_created'], name='siteflags_flag_uct'),
+        ),
+        migrations.AddIndex(
+            model_name='flag',
+            index=models.Index(fields=['content_type', 'status', '-time_created'], name='siteflags_flag_ct'),
+        ),
+        migrations.AlterField(
+            model_name='flag',
+            name='object_id',
+            field=models.PositiveIntegerField(verbose_name='Object ID'),
+        ),
+        migrations.AlterField(
+            model_name='flag',
+            name='status',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Status'),
+        ),
+    ]
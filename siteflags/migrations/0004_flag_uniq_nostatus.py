@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:24
+
+from django.db import migrations, models
+
+
+def remove_duplicates(apps, schema_editor):
+    # Duplicates would not allow the constraint to be created.
+    flag_model = apps.get_model('siteflags', 'Flag')
+
+    older = flag_model.objects.filter(
+        content_type_id=models.OuterRef('content_type_id'),
+        object_id=models.OuterRef('object_id'),
+        user_id=models.OuterRef('user_id'),
+        status__isnull=True,
+        id__lt=models.OuterRef('id'),
+    )
+    flags_ids = list(
+        flag_model.objects.filter(models.Exists(older), status__isnull=True).values_list('id', flat=True))
+
+    for idx in range(0, len(flags_ids), 1000):
+        flag_model.objects.filter(id__in=flags_ids[idx:idx + 1000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('siteflags', '0003_flag_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='flag',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__isnull', True)), fields=('content_type', 'object_id', 'user'), name='siteflags_flag_uniq_nostatus'),
+        ),
+    ]
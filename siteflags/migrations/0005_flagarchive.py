@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('siteflags', '0004_flag_uniq_nostatus'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlagArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('note', models.TextField(blank=True, verbose_name='Note')),
+                ('status', models.IntegerField(blank=True, null=True, verbose_name='Status')),
+                ('time_created', models.DateTimeField(verbose_name='Date created')),
+                ('time_archived', models.DateTimeField(auto_now_add=True, verbose_name='Date archived')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Object ID')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype', verbose_name='Content type')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Archived flag',
+                'verbose_name_plural': 'Archived flags',
+            },
+        ),
+    ]
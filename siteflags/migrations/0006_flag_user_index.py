@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('siteflags', '0005_flagarchive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flag',
+            index=models.Index(fields=['user', 'status', '-time_created', '-id'], name='siteflags_flag_us'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('siteflags', '0006_flag_user_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='flag',
+            name='siteflags_flag_uct',
+        ),
+        migrations.AlterField(
+            model_name='flag',
+            name='content_type',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(app_label)s_%(class)s_flags', to='contenttypes.contenttype', verbose_name='Content type'),
+        ),
+        migrations.AlterField(
+            model_name='flag',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='%(class)s_users', to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+    ]
@@ -1,24 +1,80 @@
-from collections import defaultdict
-from typing import List, Type, Dict, Union, Tuple, Optional, Sequence
+from collections import defaultdict, Counter
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import List, Type, Dict, Union, Tuple, Optional, Sequence, Callable, Iterator, Set, NamedTuple, Iterable
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
-from django.db import models, IntegrityError
+from django.db import models, IntegrityError, transaction
+from django.db.models import F, Q, Count, Sum, Exists, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
 from django.db.models.query import QuerySet
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 from etc.toolbox import get_model_class_from_string
 
+from .buffer import get_flags_buffer
+from .cache import ObjectsIds, get_flags_cache, invalidate_flags_cache
+from .metrics import instrumented
+from . import settings as siteflags_settings
 from .settings import MODEL_FLAG
-from .utils import get_flag_model
+from .utils import (
+    get_flag_model, get_content_type_id, get_content_types_ids, aget_content_type_id, aget_content_types_ids,
+)
 
 if False:  # pragma: nocover
     from django.contrib.auth.models import User  # noqa
 
 USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
-TypeFlagsForType = List['FlagBase']
+TypeFlagsForType = List[Union['FlagBase', 'FlagRecord']]
 TypeFlagsForTypes = Dict[Type[models.Model], TypeFlagsForType]
+TypeStatus = Union[int, Sequence[int]]
+TypeCursor = Tuple[datetime, int]
+TypeWithObjects = Union[bool, Dict[Type[models.Model], QuerySet]]
+
+PREFETCHED_FLAGS_ATTR = '_siteflags_prefetched'
+"""Name of an object attribute to store prefetched flags in."""
+
+IF_EXISTS_CHOICES = (None, 'ignore', 'update_note')
+"""Supported values for `if_exists` argument of `set_flag()`."""
+
+_DELETING_WITH_FLAGS: ContextVar[bool] = ContextVar('siteflags_deleting_with_flags', default=False)
+"""Whether objects are being deleted with `delete_with_flags()` (their flags are already removed)."""
+
+
+def make_flag_indexes(prefix: str) -> List[models.Index]:
+    """Helper. Returns indexes for flags model.
+
+    :param prefix: Index names prefix.
+
+    """
+    return [
+        # Flags for types: get_flags_for_types().
+        models.Index(
+            fields=['content_type', 'status', '-time_created'],
+            name=f'{prefix}_ct',
+        ),
+        # User flags: get_user_flags(), get_flags_for_types(user=...).
+        # Also serves user foreign key (cascade deletion).
+        models.Index(
+            fields=['user', 'status', '-time_created', '-id'],
+            name=f'{prefix}_us',
+        ),
+    ]
+
+
+class FlagRecord(NamedTuple):
+    """Lightweight flag representation (see `lightweight` argument of flags lookup methods)."""
+
+    id: int
+    content_type_id: int
+    object_id: int
+    user_id: int
+    status: Optional[int]
+    time_created: datetime
 
 
 class FlagBase(models.Model):
@@ -30,21 +86,22 @@ class FlagBase(models.Model):
 
     """
     note = models.TextField(_('Note'), blank=True)
-    status = models.IntegerField(_('Status'), null=True, blank=True, db_index=True)
+    status = models.IntegerField(_('Status'), null=True, blank=True)
 
+    # Foreign keys are not indexed separately: those are leading columns of other indexes.
     user = models.ForeignKey(
         USER_MODEL, related_name='%(class)s_users', verbose_name=_('User'),
-        on_delete=models.CASCADE)
+        on_delete=models.CASCADE, db_index=False)
 
     time_created = models.DateTimeField(_('Date created'), auto_now_add=True)
 
     # Here follows a link to an object.
-    object_id = models.PositiveIntegerField(verbose_name=_('Object ID'), db_index=True)
+    object_id = models.PositiveIntegerField(verbose_name=_('Object ID'))
 
     content_type = models.ForeignKey(
         ContentType, verbose_name=_('Content type'),
         related_name='%(app_label)s_%(class)s_flags',
-        on_delete=models.CASCADE)
+        on_delete=models.CASCADE, db_index=False)
 
     linked_object = GenericForeignKey()
 
@@ -56,13 +113,27 @@ class FlagBase(models.Model):
         verbose_name_plural = _('Flags')
 
         unique_together = (
+            # Also serves lookups by objects: (content_type, object_id[, user[, status]]).
             'content_type',
             'object_id',
             'user',
             'status',
         )
 
+        constraints = [
+            # Unique constraint above won't work for NULLs.
+            models.UniqueConstraint(
+                fields=['content_type', 'object_id', 'user'],
+                condition=Q(status__isnull=True),
+                name='%(app_label)s_%(class)s_uniq_nostatus',
+            ),
+        ]
+
+        # Short names not to exceed index name length limit for custom flag models.
+        indexes = make_flag_indexes('%(class)s')
+
     @classmethod
+    @instrumented('get_flags_for_types', subject='mdl_classes')
     def get_flags_for_types(
             cls,
             mdl_classes: List[Type[models.Model]],
@@ -70,7 +141,8 @@ class FlagBase(models.Model):
             user: 'User' = None,
             status: int = None,
             allow_empty: bool = True,
-            with_objects: bool = False,
+            with_objects: TypeWithObjects = False,
+            lightweight: bool = False,
 
     ) -> TypeFlagsForTypes:
         """Returns a dictionary with flag objects associated with the given model classes (types).
@@ -82,32 +154,55 @@ class FlagBase(models.Model):
         :param status: Status filter
         :param allow_empty: Flag. Include results for all given types, even those without associated flags.
         :param with_objects: Whether to fetch the flagged objects along with the flags.
+            May be a dictionary of querysets indexed by models, to fetch objects
+            using those (e.g. to apply select_related() or only()).
+        :param lightweight: Return `FlagRecord` tuples instead of flag model objects.
 
         """
+        if with_objects and lightweight:
+            raise ValueError("'with_objects' is not supported in lightweight mode")
+
         if not mdl_classes or (user and not user.id):
             return {}
 
-        types_for_models = ContentType.objects.get_for_models(*mdl_classes, for_concrete_models=False)
-        filter_kwargs = {'content_type__in': types_for_models.values()}
-        update_filter_dict(filter_kwargs, user=user, status=status)
+        types_for_models = get_content_types_ids(mdl_classes, for_concrete_models=False)
 
-        flags = cls.objects.filter(**filter_kwargs)
+        flags_dict = None
+        flags_cache = None if with_objects else get_flags_cache()
 
-        if with_objects:
-            flags = flags.prefetch_related('linked_object')
+        if flags_cache:
+            cache_key = flags_cache.get_types_key(
+                'types_records' if lightweight else 'types',
+                sorted(types_for_models.values()),
+                user_id=user.id if user else None,
+                status=status,
+            )
+            flags_dict = flags_cache.get(cache_key)
 
-        flags = flags.order_by('-time_created')
+        if flags_dict is None:
 
-        flags_dict = defaultdict(list)
+            filter_kwargs = {'content_type_id__in': types_for_models.values()}
+            update_filter_dict(filter_kwargs, user=user, status=status)
 
-        for flag in flags:
-            flags_dict[flag.content_type_id].append(flag)
+            flags = list(iter_flags(
+                cls.objects.filter(**filter_kwargs).order_by('-time_created'), lightweight=lightweight))
+
+            if with_objects:
+                load_linked_objects(flags, querysets=with_objects)
+
+            flags_dict = defaultdict(list)
+
+            for flag in flags:
+                flags_dict[flag.content_type_id].append(flag)
+
+            if flags_cache:
+                flags_cache.set(cache_key, dict(flags_dict))
 
         result = {}  # Respect initial order.
 
         for mdl_cls in mdl_classes:
 
-            content_type_id = types_for_models[mdl_cls].id
+            content_type_id = types_for_models[mdl_cls]
 
             if content_type_id in flags_dict:
                 result[mdl_cls] = flags_dict[content_type_id]
@@ -118,227 +213,2095 @@ class FlagBase(models.Model):
         return result
 
     @classmethod
+    def iter_flags_for_types(
+            cls,
+            mdl_classes: List[Type[models.Model]],
+            *,
+            user: 'User' = None,
+            status: int = None,
+            with_objects: TypeWithObjects = False,
+            batch_size: int = 1000,
+            after: TypeCursor = None,
+
+    ) -> Iterator[TypeFlagsForTypes]:
+        """Iterates over flag objects associated with the given model classes (types)
+        in batches, newest first, not loading all the flags into memory at once.
+
+        Yields dictionaries indexed by model classes.
+        Each dict entry contains a list of associated flags from a batch.
+        Types without flags in a batch are omitted.
+
+        Use ``get_cursor()`` of the last flag to continue iteration later (see ``after``).
+
+        :param mdl_classes: Types to get flags for.
+        :param user: User filter,
+        :param status: Status filter
+        :param with_objects: Whether to fetch the flagged objects along with the flags.
+            May be a dictionary of querysets indexed by models, to fetch objects
+            using those (e.g. to apply select_related() or only()).
+        :param batch_size: Number of flags to fetch at once.
+        :param after: Cursor. Iterate over flags older than a flag with this cursor.
+
+        """
+        if not mdl_classes or (user and not user.id):
+            return
+
+        types_for_models = get_content_types_ids(mdl_classes, for_concrete_models=False)
+        models_for_types = {content_type_id: mdl_cls for mdl_cls, content_type_id in types_for_models.items()}
+
+        filter_kwargs = {'content_type_id__in': types_for_models.values()}
+        update_filter_dict(filter_kwargs, user=user, status=status)
+
+        flags_base = cls.objects.filter(**filter_kwargs).order_by('-time_created', '-id')
+
+        while True:
+            flags = flags_base
+
+            if after:
+                flags = flags.filter(get_cursor_filter(after))
+
+            batch = list(flags[:batch_size].iterator(chunk_size=batch_size))
+
+            if not batch:
+                break
+
+            if with_objects:
+                load_linked_objects(batch, querysets=with_objects)
+
+            result = defaultdict(list)
+
+            for flag in batch:
+                result[models_for_types[flag.content_type_id]].append(flag)
+
+            yield dict(result)
+
+            if len(batch) < batch_size:
+                break
+
+            after = batch[-1].get_cursor()
+
+    @classmethod
+    @instrumented('get_user_flags', subject=None)
+    def get_user_flags(
+            cls,
+            user: 'User',
+            *,
+            status: TypeStatus = None,
+            after: TypeCursor = None,
+            limit: int = 50,
+            with_objects: TypeWithObjects = True,
+
+    ) -> List['FlagBase']:
+        """Returns a page of user flags of all types, newest first.
+
+        Use ``get_cursor()`` of the last flag to get the next page (see ``after``).
+
+        :param user:
+        :param status: Optional status filter. Status or a sequence of statuses.
+        :param after: Cursor. Get flags older than a flag with this cursor.
+        :param limit: Max number of flags to return.
+        :param with_objects: Whether to fetch the flagged objects along with the flags
+            (using a query per objects type).
+            May be a dictionary of querysets indexed by models, to fetch objects
+            using those (e.g. to apply select_related() or only()).
+
+        """
+        if not user.id:
+            return []
+
+        filter_kwargs = {}
+        update_filter_dict(filter_kwargs, user=user, status=status)
+
+        flags = cls.objects.filter(**filter_kwargs)
+
+        if after:
+            flags = flags.filter(get_cursor_filter(after))
+
+        flags = list(flags.order_by('-time_created', '-id')[:limit])
+
+        if with_objects:
+            load_linked_objects(flags, querysets=with_objects)
+
+        return flags
+
+    @classmethod
+    @instrumented('get_flags_for_objects', subject='objects_list')
     def get_flags_for_objects(
             cls,
             objects_list: Union[QuerySet, Sequence],
             *,
             user: 'User' = None,
-            status: int = None
+            status: TypeStatus = None,
+            lightweight: bool = False,
+            key_by_model: bool = False,
 
-    ) -> Dict[int, TypeFlagsForType]:
+    ) -> Dict[Union[int, Tuple[Type[models.Model], int]], TypeFlagsForType]:
         """Returns a dictionary with flag objects associated with the given model objects.
         The dictionary is indexed by objects IDs.
         Each dict entry contains a list of associated flag objects.
 
-        :param objects_list:
+        :param objects_list: Objects to get flags for. May be of different types.
         :param user:
-        :param status:
+        :param status: Status or a sequence of statuses.
+        :param lightweight: Return `FlagRecord` tuples instead of flag model objects.
+        :param key_by_model: Index the dictionary by (model class, object ID) tuples.
+            Useful for objects of different types, since their IDs may clash.
 
         """
-        if not objects_list or (user and not user.id):
+        if user and not user.id:
             return {}
 
-        objects_ids = objects_list
-        if not isinstance(objects_list, QuerySet):
-            objects_ids = [obj.pk for obj in objects_list]
-
-        filter_kwargs = {
-            'object_id__in': objects_ids,
-            # Consider this list homogeneous.
-            'content_type': ContentType.objects.get_for_model(objects_list[0], for_concrete_model=False)
-        }
-        update_filter_dict(filter_kwargs, user=user, status=status)
+        objects_list = list(objects_list)  # Evaluate a queryset only once.
 
-        flags = cls.objects.filter(**filter_kwargs)
-        flags_dict = defaultdict(list)
+        if not objects_list:
+            return {}
 
-        for flag in flags:
-            flags_dict[flag.object_id].append(flag)
+        grouped = group_objects_by_type(objects_list, for_concrete_models=False)
 
-        result = {}
+        flags_dict = defaultdict(list)
+        flags_cache = get_flags_cache()
+        cache_keys = {}
 
-        for obj in objects_list:
-            result[obj.pk] = flags_dict.get(obj.pk, [])
+        if flags_cache:
+            for content_type_id, objects_ids in grouped.items():
 
-        return result
+                keys = flags_cache.get_objects_keys(
+                    'records' if lightweight else 'flags', content_type_id, objects_ids,
+                    user_id=user.id if user else None,
+                    status=status,
+                )
+                cache_keys.update({(content_type_id, object_id): key for object_id, key in keys.items()})
 
-    def __str__(self):
-        return f'{self.content_type}:{self.object_id} status {self.status}'
+            flags_dict.update(flags_cache.get_many(cache_keys))
 
+            grouped = {
+                content_type_id: [
+                    object_id for object_id in objects_ids if (content_type_id, object_id) not in flags_dict]
+                for content_type_id, objects_ids in grouped.items()
+            }
 
-class Flag(FlagBase):
-    """Built-in flag class. Default functionality."""
+        if any(grouped.values()):
 
+            filter_kwargs = {}
+            update_filter_dict(filter_kwargs, user=user, status=status)
 
-class ModelWithFlag(models.Model):
-    """Helper base class for models with flags.
+            flags = cls.objects.filter(get_objects_filter(grouped), **filter_kwargs)
 
-    Inherit from this model to be able to mark model instances.
+            for flag in iter_flags(flags, lightweight=lightweight):
+                flags_dict[(flag.content_type_id, flag.object_id)].append(flag)
 
-    """
-    flags = GenericRelation(MODEL_FLAG)
+            if flags_cache:
+                flags_cache.set_many({
+                    cache_keys[(content_type_id, object_id)]: flags_dict[(content_type_id, object_id)]
+                    for content_type_id, objects_ids in grouped.items()
+                    for object_id in objects_ids
+                })
 
-    class Meta:
-        abstract = True
+        return get_objects_result(objects_list, flags_dict, key_by_model=key_by_model)
 
     @classmethod
-    def get_flags_for_type(
+    @instrumented('aget_flags_for_types', subject='mdl_classes')
+    async def aget_flags_for_types(
             cls,
-            mdl_classes: List[Type[models.Model]] = None,
+            mdl_classes: List[Type[models.Model]],
             *,
             user: 'User' = None,
             status: int = None,
             allow_empty: bool = True,
-            with_objects: bool = False,
-
-    ) -> Union[TypeFlagsForTypes, TypeFlagsForType]:
-        """Returns a dictionary with flag objects associated with
-        the given model classes (types) if mdl_classes is given.
-        The dictionary is indexed by model classes.
-        Each dict entry contains a list of associated flag objects.
+            with_objects: TypeWithObjects = False,
 
-        If mdl_classes is not given, returns a list of associated
-        flag objects for this very class.
+    ) -> TypeFlagsForTypes:
+        """Asynchronous version of `get_flags_for_types()`.
 
-        :param mdl_classes: Types to get flags for. If not set the current class is used.
+        :param mdl_classes: Types to get flags for.
         :param user: User filter,
         :param status: Status filter
         :param allow_empty: Flag. Include results for all given types, even those without associated flags.
         :param with_objects: Whether to fetch the flagged objects along with the flags.
+            May be a dictionary of querysets indexed by models, to fetch objects
+            using those (e.g. to apply select_related() or only()).
 
         """
-        model: FlagBase = get_model_class_from_string(MODEL_FLAG)
+        if use_sync_api():
+            return await sync_to_async(cls.get_flags_for_types)(
+                mdl_classes, user=user, status=status, allow_empty=allow_empty, with_objects=with_objects)
 
-        single_type = False
-        if mdl_classes is None:
-            mdl_classes = [cls]
-            single_type = True
-            allow_empty = True
+        if not mdl_classes or (user and not user.id):
+            return {}
 
-        result = model.get_flags_for_types(
-            mdl_classes,
-            user=user,
-            status=status,
-            allow_empty=allow_empty,
-            with_objects=with_objects,
-        )
+        types_for_models = await aget_content_types_ids(mdl_classes, for_concrete_models=False)
 
-        if single_type:
-            result = result[cls]
+        filter_kwargs = {'content_type_id__in': types_for_models.values()}
+        update_filter_dict(filter_kwargs, user=user, status=status)
 
-        return result
+        flags = [flag async for flag in cls.objects.filter(**filter_kwargs).order_by('-time_created')]
 
-    get_flags_for_types = get_flags_for_type  # alias
+        if with_objects:
+            await sync_to_async(load_linked_objects)(flags, querysets=with_objects)
+
+        flags_dict = defaultdict(list)
+
+        for flag in flags:
+            flags_dict[flag.content_type_id].append(flag)
+
+        result = {}  # Respect initial order.
+
+        for mdl_cls in mdl_classes:
+
+            content_type_id = types_for_models[mdl_cls]
+
+            if content_type_id in flags_dict:
+                result[mdl_cls] = flags_dict[content_type_id]
+
+            elif allow_empty:
+                result[mdl_cls] = []
+
+        return result
 
     @classmethod
-    def get_flags_for_objects(
+    @instrumented('aget_flags_for_objects', subject='objects_list')
+    async def aget_flags_for_objects(
             cls,
             objects_list: Union[QuerySet, Sequence],
             *,
             user: 'User' = None,
-            status: int = None
+            status: TypeStatus = None,
+            key_by_model: bool = False,
 
-    ) -> Dict[int, TypeFlagsForType]:
-        """Returns a dictionary with flag objects associated with the given model objects.
-        The dictionary is indexed by objects IDs.
-        Each dict entry contains a list of associated flag objects.
+    ) -> Dict[Union[int, Tuple[Type[models.Model], int]], TypeFlagsForType]:
+        """Asynchronous version of `get_flags_for_objects()`.
 
-        :param objects_list:
+        :param objects_list: Objects to get flags for. May be of different types.
         :param user:
-        :param status:
+        :param status: Status or a sequence of statuses.
+        :param key_by_model: Index the dictionary by (model class, object ID) tuples.
 
         """
-        model: FlagBase = get_model_class_from_string(MODEL_FLAG)
-        return model.get_flags_for_objects(objects_list, user=user, status=status)
+        if isinstance(objects_list, QuerySet):
+            objects_list = [obj async for obj in objects_list]
 
-    def get_flags(self, user: 'User' = None, *, status: int = None) -> Union[QuerySet, Sequence[FlagBase]]:
-        """Returns flags for the object optionally filtered by status.
+        if use_sync_api():
+            return await sync_to_async(cls.get_flags_for_objects)(
+                objects_list, user=user, status=status, key_by_model=key_by_model)
 
-        :param user: Optional user filter
-        :param status: Optional status filter
+        if not objects_list or (user and not user.id):
+            return {}
+
+        # Resolve content types not to query for them from a grouping helper.
+        await aget_content_types_ids({type(obj) for obj in objects_list}, for_concrete_models=False)
 
-        """
         filter_kwargs = {}
         update_filter_dict(filter_kwargs, user=user, status=status)
-        return self.flags.filter(**filter_kwargs).all()
 
-    def set_flag(self, user: 'User', *, note: str = None, status: int = None) -> Optional[FlagBase]:
-        """Flags the object.
+        flags = cls.objects.filter(
+            get_objects_filter(group_objects_by_type(objects_list, for_concrete_models=False)), **filter_kwargs)
+
+        flags_dict = defaultdict(list)
+
+        async for flag in flags:
+            flags_dict[(flag.content_type_id, flag.object_id)].append(flag)
+
+        return get_objects_result(objects_list, flags_dict, key_by_model=key_by_model)
+
+    @classmethod
+    @instrumented('set_flags_for_objects', subject='objects_list')
+    def set_flags_for_objects(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            user: 'User',
+            note: str = None,
+            status: int = None
+
+    ) -> int:
+        """Flags all the given objects at once. Returns a number of flags created.
+
+        Objects already flagged by the user with the same status are skipped.
+
+        Existing flags are looked up before insertion, so if the same flags are created
+        concurrently, those are counted (both in the result and in flag counters) as created
+        by this call too. Use `FlagCounter.rebuild()` to fix counters if that's the case.
 
+        :param objects_list: Objects to flag. May be of different types.
         :param user:
-        :param note: User-defined note for this flag.
+        :param note: User-defined note for flags.
         :param status: Optional status integer (the meaning is defined by a developer).
 
         """
-        if not user.id:
-            return None
+        if not objects_list or not user.id:
+            return 0
+
+        init_kwargs = {'user': user}
 
-        init_kwargs = {
-            'user': user,
-            'linked_object': self,
-        }
         if note is not None:
             init_kwargs['note'] = note
 
         if status is not None:
             init_kwargs['status'] = status
 
-        flag = get_flag_model()(**init_kwargs)
+        filter_kwargs = {}
+        update_filter_dict(filter_kwargs, user=user, status=status)
+
+        if status is None:
+            filter_kwargs['status__isnull'] = True
 
-        try:
-            flag.save()
+        flags = []
+        affected = {}
 
-        except IntegrityError:  # Record already exists.
-            return None
+        for content_type_id, objects_ids in group_objects_by_type(objects_list).items():
 
-        return flag
+            existing = set(cls.objects.filter(
+                content_type_id=content_type_id,
+                object_id__in=objects_ids,
+                **filter_kwargs
+            ).values_list('object_id', flat=True))
 
-    def remove_flag(self, user: 'User' = None, *, status: int = None):
-        """Removes flag(s) from the object.
+            flags_for_type = [
+                cls(content_type_id=content_type_id, object_id=object_id, **init_kwargs)
+                for object_id in objects_ids if object_id not in existing
+            ]
+            flags.extend(flags_for_type)
+            affected[content_type_id] = [flag.object_id for flag in flags_for_type]
+
+        with transaction.atomic():
+            # Conflicts may still arise from concurrent writes, those are ignored.
+            cls.objects.bulk_create(flags, ignore_conflicts=True)
+
+            if siteflags_settings.COUNTERS:
+                for content_type_id, objects_ids in affected.items():
+                    FlagCounter.update_counts(content_type_id, objects_ids, status=status, delta=1)
+
+        forget_prefetched_flags(objects_list)
+
+        for content_type_id, objects_ids in affected.items():
+            invalidate_flags_cache(content_type_id, objects_ids, user_id=user.id)
+
+        return len(flags)
+
+    @classmethod
+    @instrumented('remove_flags_for_objects', subject='objects_list')
+    def remove_flags_for_objects(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            user: 'User' = None,
+            status: int = None
+
+    ) -> int:
+        """Removes flags from all the given objects at once. Returns a number of flags removed.
 
+        :param objects_list: Objects to remove flags from. May be of different types.
         :param user: Optional user filter
         :param status: Optional status filter
 
         """
-        filter_kwargs = {
-            'content_type': ContentType.objects.get_for_model(self),
-            'object_id': self.id
-        }
+        if not objects_list or (user and not user.id):
+            return 0
+
+        filter_kwargs = {}
         update_filter_dict(filter_kwargs, user=user, status=status)
-        get_flag_model().objects.filter(**filter_kwargs).delete()
 
-    def is_flagged(self, user: 'User' = None, *, status: int = None) -> int:
-        """Returns a number of times the object is flagged by a user.
+        removed = 0
+        flags_buffer = get_flags_buffer()
 
-        :param user: Optional user filter
-        :param status: Optional status filter
+        for content_type_id, objects_ids in group_objects_by_type(objects_list).items():
+            removed += flags_buffer.discard(
+                content_type_id, objects_ids, user_id=user.id if user else None, status=status)
+            removed += delete_flags(cls.objects.filter(
+                content_type_id=content_type_id,
+                object_id__in=objects_ids,
+                **filter_kwargs
+            ), content_type_id=content_type_id)
+            invalidate_flags_cache(content_type_id, objects_ids, user_id=user.id if user else None)
+
+        forget_prefetched_flags(objects_list)
+
+        return removed
+
+    @classmethod
+    @instrumented('get_flag_counts_for_objects', subject='objects_list')
+    def get_flag_counts_for_objects(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            status: int = None
+
+    ) -> Dict[int, int]:
+        """Returns a dictionary with flags counts for the given model objects.
+        The dictionary is indexed by objects IDs.
+
+        Uses flag counters if enabled with SITEFLAGS_COUNTERS setting.
+
+        :param objects_list: Homogeneous objects list.
+        :param status: Optional status filter. If not set counts for all statuses are summed up.
 
         """
-        if user and user.is_anonymous:
-            return False
+        if not objects_list:
+            return {}
+
+        objects_list = list(objects_list)
 
         filter_kwargs = {
-            'content_type': ContentType.objects.get_for_model(self),
-            'object_id': self.id,
+            'object_id__in': [obj.pk for obj in objects_list],
+            # Consider this list homogeneous.
+            'content_type_id': get_content_type_id(objects_list[0]),
         }
-        update_filter_dict(filter_kwargs, user=user, status=status)
-        return self.flags.filter(**filter_kwargs).count()
+        update_filter_dict(filter_kwargs, user=None, status=status)
 
+        if siteflags_settings.COUNTERS:
+            counts = FlagCounter.objects.filter(**filter_kwargs).values('object_id').annotate(cnt=Sum('count'))
 
-def update_filter_dict(d: dict, *, user: Optional['User'], status: Optional[int]):
-    """Helper. Updates filter dict for a queryset.
+        else:
+            counts = cls.objects.filter(**filter_kwargs).values('object_id').annotate(cnt=Count('id'))
 
-    :param d:
-    :param user:
-    :param status:
+        counts = {item['object_id']: item['cnt'] for item in counts.order_by()}
 
-    """
-    if user is not None:
+        return {obj.pk: counts.get(obj.pk, 0) for obj in objects_list}
 
-        if not user.id:
-            return None
+    @classmethod
+    @instrumented('get_flag_statuses_for_objects', subject='objects_list')
+    def get_flag_statuses_for_objects(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            user: 'User' = None,
+            status: TypeStatus = None
 
-        d['user'] = user
+    ) -> Dict[int, Dict[Optional[int], int]]:
+        """Returns a dictionary with flags counts by statuses for the given model objects
+        using a single aggregate query.
 
-    if status is not None:
-        d['status'] = status
+        The dictionary is indexed by objects IDs. Each dict entry
+        is a dictionary of flags counts indexed by statuses (only those with flags).
+
+        Uses flag counters if enabled with SITEFLAGS_COUNTERS setting and no user is given.
+
+        :param objects_list: Homogeneous objects list.
+        :param user: Optional user filter
+        :param status: Optional status filter. Status or a sequence of statuses.
+
+        """
+        if not objects_list or (user and not user.id):
+            return {}
+
+        objects_list = list(objects_list)
+
+        filter_kwargs = {
+            'object_id__in': [obj.pk for obj in objects_list],
+            # Consider this list homogeneous.
+            'content_type_id': get_content_type_id(objects_list[0]),
+        }
+        update_filter_dict(filter_kwargs, user=user, status=status)
+
+        if user is None and siteflags_settings.COUNTERS:
+            counts = FlagCounter.objects.filter(**filter_kwargs).values('object_id', 'status', cnt=F('count'))
+
+        else:
+            counts = cls.objects.filter(**filter_kwargs).values('object_id', 'status').annotate(cnt=Count('id'))
+
+        result = {obj.pk: {} for obj in objects_list}
+
+        for item in counts.order_by():
+            if item['cnt']:
+                result[item['object_id']][item['status']] = item['cnt']
+
+        return result
+
+    @classmethod
+    @instrumented('filter_flagged_ids', subject='mdl_class')
+    def filter_flagged_ids(
+            cls,
+            mdl_class: Type[models.Model],
+            objects_ids: Sequence[int],
+            *,
+            user: 'User',
+            status: TypeStatus = None
+
+    ) -> List[int]:
+        """Returns those of the given objects IDs which are flagged by the user (preserving order).
+
+        If caching is enabled with SITEFLAGS_CACHE setting, IDs of all objects of the type
+        flagged by the user are cached in a compact form (see `ObjectsIds`), so that
+        subsequent calls for any objects IDs are served without DB queries.
+
+        :param mdl_class: Objects type.
+        :param objects_ids:
+        :param user:
+        :param status: Optional status filter. Status or a sequence of statuses.
+
+        """
+        if not objects_ids or not user.id:
+            return []
+
+        content_type_id = get_content_type_id(mdl_class)
+
+        filter_kwargs = {'content_type_id': content_type_id}
+        update_filter_dict(filter_kwargs, user=user, status=status)
+
+        flags_cache = get_flags_cache()
+
+        if flags_cache is None:
+            flagged = set(cls.objects.filter(
+                object_id__in=objects_ids, **filter_kwargs).values_list('object_id', flat=True))
+
+            return [object_id for object_id in objects_ids if object_id in flagged]
+
+        cache_key = flags_cache.get_types_key('ids', [content_type_id], user_id=user.id, status=status)
+        flagged = flags_cache.get_ids(cache_key)
+
+        if flagged is None:
+            flagged = ObjectsIds(
+                cls.objects.filter(**filter_kwargs).values_list('object_id', flat=True).order_by().iterator())
+            flags_cache.set_ids(cache_key, flagged)
+
+        return flagged.filter(objects_ids)
+
+    @classmethod
+    @instrumented('get_top_flagged', subject='mdl_class')
+    def get_top_flagged(
+            cls,
+            mdl_class: Type[models.Model],
+            *,
+            status: TypeStatus = None,
+            since: datetime = None,
+            limit: int = 10,
+            with_objects: bool = False
+
+    ) -> List[Tuple[Union[int, models.Model], int]]:
+        """Returns a list of the most flagged objects of the given type
+        as (object ID, flags count) tuples ordered by count (descending).
+
+        Counting is done by DB. Uses flag counters if enabled with SITEFLAGS_COUNTERS setting
+        and `since` is not set. Results are cached if SITEFLAGS_CACHE is set and `since` is not set
+        (it's usually relative to the current time, so that a cache key would be different every time).
+
+        :param mdl_class: Type to get objects for.
+        :param status: Optional status filter. Status or a sequence of statuses.
+        :param since: Only count flags created since this time.
+        :param limit: Maximum number of objects to return.
+        :param with_objects: Return objects instead of their IDs. Objects
+            which no longer exist are omitted.
+
+        """
+        content_type_id = get_content_type_id(mdl_class)
+
+        top = None
+        flags_cache = None if since else get_flags_cache()
+
+        if flags_cache:
+            cache_key = flags_cache.get_types_key(
+                f'top.{limit}',
+                [content_type_id],
+                user_id=None,
+                status=status,
+            )
+            top = flags_cache.get(cache_key)
+
+        if top is None:
+
+            filter_kwargs = {'content_type_id': content_type_id}
+            update_filter_dict(filter_kwargs, user=None, status=status)
+
+            if since is None and siteflags_settings.COUNTERS:
+                counts = FlagCounter.objects.filter(**filter_kwargs).values('object_id').annotate(cnt=Sum('count'))
+
+            else:
+                if since is not None:
+                    filter_kwargs['time_created__gte'] = since
+
+                counts = cls.objects.filter(**filter_kwargs).values('object_id').annotate(cnt=Count('id'))
+
+            top = [
+                (item['object_id'], item['cnt'])
+                for item in counts.filter(cnt__gt=0).order_by('-cnt', 'object_id')[:limit]
+            ]
+
+            if flags_cache:
+                flags_cache.set(cache_key, top)
+
+        if with_objects:
+            objects = mdl_class._default_manager.in_bulk([object_id for object_id, _ in top])
+            top = [(objects[object_id], cnt) for object_id, cnt in top if object_id in objects]
+
+        return top
+
+    @classmethod
+    def remove_duplicates(cls, *, chunk_size: int = 1000) -> int:
+        """Removes duplicate flags without status (those could be created before
+        uniqueness for such flags is enforced). The oldest flag of duplicates is kept.
+        Returns a number of flags removed.
+
+        :param chunk_size: Number of flags to delete at once.
+
+        """
+        duplicates = defaultdict(list)
+
+        for flag_id, content_type_id in get_duplicate_flags(cls).values_list('id', 'content_type_id').iterator():
+            duplicates[content_type_id].append(flag_id)
+
+        removed = 0
+
+        for content_type_id, flags_ids in duplicates.items():
+            for idx in range(0, len(flags_ids), chunk_size):
+                removed += delete_flags(
+                    cls.objects.filter(id__in=flags_ids[idx:idx + chunk_size]),
+                    content_type_id=content_type_id)
+
+        if removed:
+            flags_cache = get_flags_cache()
+
+            if flags_cache:
+                flags_cache.invalidate_all()
+
+        return removed
+
+    @classmethod
+    def purge_expired(
+            cls,
+            *,
+            retention: Dict[Optional[int], Union[timedelta, int]] = None,
+            archive: bool = None,
+            chunk_size: int = 1000,
+            progress: Callable[[int], None] = None
+
+    ) -> int:
+        """Removes expired flags in batches. Returns a number of flags removed.
+
+        :param retention: Flags time to live by statuses. Default: SITEFLAGS_RETENTION setting.
+        :param archive: Whether to move flags into archive (FlagArchive model).
+            Default: SITEFLAGS_ARCHIVE setting.
+        :param chunk_size: Number of flags to remove at once.
+        :param progress: Callable to be called with a total number of flags removed after every batch.
+
+        """
+        if retention is None:
+            retention = siteflags_settings.RETENTION
+
+        if archive is None:
+            archive = siteflags_settings.ARCHIVE
+
+        if not retention:
+            return 0
+
+        # Content types are iterated over to allow index use: (content_type, status, time_created).
+        content_types_ids = list(cls.objects.order_by().values_list('content_type_id', flat=True).distinct())
+        time_now = now()
+        removed = 0
+
+        for status, ttl in retention.items():
+
+            if not isinstance(ttl, timedelta):
+                ttl = timedelta(seconds=ttl)
+
+            filter_kwargs = {'time_created__lt': time_now - ttl}
+
+            if status is None:
+                filter_kwargs['status__isnull'] = True
+
+            else:
+                filter_kwargs['status'] = status
+
+            for content_type_id in content_types_ids:
+
+                expired = cls.objects.filter(content_type_id=content_type_id, **filter_kwargs)
+
+                while True:
+                    flags_ids = list(expired.order_by('time_created').values_list('id', flat=True)[:chunk_size])
+
+                    if not flags_ids:
+                        break
+
+                    flags = cls.objects.filter(id__in=flags_ids)
+
+                    with transaction.atomic():
+                        if archive:
+                            FlagArchive.objects.bulk_create([
+                                FlagArchive(**values) for values in flags.values(*FlagArchive.FLAG_FIELDS)])
+
+                        removed += delete_flags(flags, content_type_id=content_type_id)
+
+                    if progress:
+                        progress(removed)
+
+                    if len(flags_ids) < chunk_size:
+                        break
+
+        if removed:
+            flags_cache = get_flags_cache()
+
+            if flags_cache:
+                flags_cache.invalidate_all()
+
+        return removed
+
+    @classmethod
+    def remove_orphans(
+            cls,
+            *,
+            include_stale_types: bool = False,
+            chunk_size: int = 1000,
+            progress: Callable[[int], None] = None
+
+    ) -> int:
+        """Removes flags of objects which no longer exist (e.g. deleted in bulk
+        by querysets not cascading to flags) in batches. Returns a number of flags removed.
+
+        :param include_stale_types: Also remove all flags of content types which models
+            are not available (e.g. application is not installed). Skipped by default.
+        :param chunk_size: Number of flags to remove at once.
+        :param progress: Callable to be called with a total number of flags removed after every batch.
+
+        """
+        content_types_ids = list(cls.objects.order_by().values_list('content_type_id', flat=True).distinct())
+        removed = 0
+
+        for content_type_id in content_types_ids:
+            orphans = cls.objects.filter(content_type_id=content_type_id)
+            mdl_class = ContentType.objects.get_for_id(content_type_id).model_class()
+
+            if mdl_class is None:
+                # The model is gone (or just not available with current settings).
+                if not include_stale_types:
+                    continue
+
+            else:
+                # Anti-join.
+                orphans = orphans.filter(
+                    ~Exists(mdl_class._base_manager.filter(pk=OuterRef('object_id')).order_by()))
+
+            while True:
+                flags_ids = list(orphans.order_by('id').values_list('id', flat=True)[:chunk_size])
+
+                if not flags_ids:
+                    break
+
+                removed += delete_flags(cls.objects.filter(id__in=flags_ids), content_type_id=content_type_id)
+
+                if progress:
+                    progress(removed)
+
+                if len(flags_ids) < chunk_size:
+                    break
+
+        if removed:
+            flags_cache = get_flags_cache()
+
+            if flags_cache:
+                flags_cache.invalidate_all()
+
+        return removed
+
+    def get_cursor(self) -> TypeCursor:
+        """Returns a cursor to be used for keyset pagination
+        to get flags following this one (older than this one).
+
+        """
+        return self.time_created, self.id
+
+    def __str__(self):
+        return f'{self.content_type}:{self.object_id} status {self.status}'
+
+
+class Flag(FlagBase):
+    """Built-in flag class. Default functionality."""
+
+    class Meta(FlagBase.Meta):
+
+        indexes = make_flag_indexes('siteflags_flag')
+
+
+class FlagCounter(models.Model):
+    """Denormalized flags counts for objects by statuses.
+
+    Maintained on flags modification through siteflags API
+    if enabled with SITEFLAGS_COUNTERS setting.
+
+    """
+    content_type = models.ForeignKey(
+        ContentType, verbose_name=_('Content type'),
+        related_name='+',
+        on_delete=models.CASCADE)
+
+    object_id = models.PositiveIntegerField(verbose_name=_('Object ID'))
+    status = models.IntegerField(_('Status'), null=True, blank=True)
+    count = models.IntegerField(_('Count'), default=0)
+
+    class Meta:
+
+        verbose_name = _('Flag counter')
+        verbose_name_plural = _('Flag counters')
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=['content_type', 'object_id', 'status'],
+                name='siteflags_counter_uniq',
+            ),
+            # Unique constraint above won't work for NULLs.
+            models.UniqueConstraint(
+                fields=['content_type', 'object_id'],
+                condition=Q(status__isnull=True),
+                name='siteflags_counter_uniq_nostatus',
+            ),
+        ]
+
+    @classmethod
+    def update_counts(cls, content_type_id: int, objects_ids: Sequence[int], *, status: Optional[int], delta: int):
+        """Atomically changes flags counts for the given objects.
+
+        :param content_type_id:
+        :param objects_ids:
+        :param status:
+        :param delta: A number to add to counts (negative to subtract).
+
+        """
+        if not objects_ids:
+            return
+
+        if delta > 0:
+            # Make sure counters exist before incrementing.
+            cls.objects.bulk_create([
+                cls(content_type_id=content_type_id, object_id=object_id, status=status)
+                for object_id in objects_ids
+            ], ignore_conflicts=True)
+
+        cls.objects.filter(
+            content_type_id=content_type_id,
+            object_id__in=objects_ids,
+            status=status,
+        ).update(count=F('count') + delta)
+
+    @classmethod
+    def count_flags(cls, flags: Sequence[FlagBase]):
+        """Increments counters for the given (just inserted) flags.
+
+        :param flags:
+
+        """
+        counts = Counter((flag.content_type_id, flag.status, flag.object_id) for flag in flags)
+        grouped = defaultdict(list)
+
+        for (content_type_id, status, object_id), count in counts.items():
+            grouped[(content_type_id, status, count)].append(object_id)
+
+        for (content_type_id, status, count), objects_ids in grouped.items():
+            cls.update_counts(content_type_id, objects_ids, status=status, delta=count)
+
+    @classmethod
+    def rebuild(cls, *, chunk_size: int = 5000) -> int:
+        """Rebuilds all counters from flags table. Returns a number of counters created.
+
+        :param chunk_size: Number of counters to insert at once.
+
+        """
+        counts = get_flag_model().objects.values(
+            'content_type_id', 'object_id', 'status').annotate(cnt=Count('id')).order_by()
+
+        created = 0
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+
+            chunk = []
+
+            for item in counts.iterator(chunk_size=chunk_size):
+                chunk.append(cls(
+                    content_type_id=item['content_type_id'],
+                    object_id=item['object_id'],
+                    status=item['status'],
+                    count=item['cnt'],
+                ))
+
+                if len(chunk) == chunk_size:
+                    cls.objects.bulk_create(chunk)
+                    created += len(chunk)
+                    chunk = []
+
+            cls.objects.bulk_create(chunk)
+            created += len(chunk)
+
+        flags_cache = get_flags_cache()
+
+        if flags_cache:
+            flags_cache.invalidate_all()
+
+        return created
+
+    def __str__(self):
+        return f'{self.content_type_id}:{self.object_id} status {self.status}: {self.count}'
+
+
+class FlagArchive(models.Model):
+    """Expired flags moved out of flags table (see SITEFLAGS_ARCHIVE setting)."""
+
+    FLAG_FIELDS = ('note', 'status', 'user_id', 'time_created', 'object_id', 'content_type_id')
+    """Fields copied from flags."""
+
+    note = models.TextField(_('Note'), blank=True)
+    status = models.IntegerField(_('Status'), null=True, blank=True)
+    user = models.ForeignKey(USER_MODEL, related_name='+', verbose_name=_('User'), on_delete=models.CASCADE)
+    time_created = models.DateTimeField(_('Date created'))
+    time_archived = models.DateTimeField(_('Date archived'), auto_now_add=True)
+    object_id = models.PositiveIntegerField(verbose_name=_('Object ID'))
+
+    content_type = models.ForeignKey(
+        ContentType, verbose_name=_('Content type'),
+        related_name='+',
+        on_delete=models.CASCADE)
+
+    class Meta:
+
+        verbose_name = _('Archived flag')
+        verbose_name_plural = _('Archived flags')
+
+    def __str__(self):
+        return f'{self.content_type_id}:{self.object_id} status {self.status}'
+
+
+class ModelWithFlagQuerySet(QuerySet):
+    """QuerySet for models with flags allowing to filter and sort objects by their flags."""
+
+    def _get_flags(self, *, user: Optional['User'], status: Optional[TypeStatus]) -> QuerySet:
+        filter_kwargs = {
+            'content_type_id': get_content_type_id(self.model),
+            'object_id': OuterRef('pk'),
+        }
+        update_filter_dict(filter_kwargs, user=user, status=status)
+
+        if user is not None and not user.id:
+            # Anonymous users have no flags.
+            filter_kwargs['user_id__isnull'] = True
+
+        return get_flag_model().objects.filter(**filter_kwargs).order_by()
+
+    def with_flag_count(
+            self,
+            *,
+            user: 'User' = None,
+            status: TypeStatus = None,
+            name: str = 'flag_count'
+
+    ) -> 'ModelWithFlagQuerySet':
+        """Annotates objects with a number of their flags.
+
+        Uses flag counters if enabled with SITEFLAGS_COUNTERS setting and no user is given.
+
+        :param user: Optional user filter
+        :param status: Optional status filter. Status or a sequence of statuses.
+        :param name: Annotation name.
+
+        """
+        if user is None and siteflags_settings.COUNTERS:
+            filter_kwargs = {
+                'content_type_id': get_content_type_id(self.model),
+                'object_id': OuterRef('pk'),
+            }
+            update_filter_dict(filter_kwargs, user=None, status=status)
+            counts = FlagCounter.objects.filter(**filter_kwargs).order_by().values('object_id').annotate(
+                cnt=Sum('count')).values('cnt')
+
+        else:
+            counts = self._get_flags(user=user, status=status).values('object_id').annotate(
+                cnt=Count('id')).values('cnt')
+
+        return self.annotate(**{name: Coalesce(Subquery(counts, output_field=IntegerField()), 0)})
+
+    def with_user_flag(
+            self,
+            user: 'User',
+            *,
+            status: TypeStatus = None,
+            name: str = 'user_flagged'
+
+    ) -> 'ModelWithFlagQuerySet':
+        """Annotates objects with a boolean whether they are flagged by the user.
+
+        :param user:
+        :param status: Optional status filter. Status or a sequence of statuses.
+        :param name: Annotation name.
+
+        """
+        return self.annotate(**{name: Exists(self._get_flags(user=user, status=status))})
+
+    def flagged_by(self, user: 'User', *, status: TypeStatus = None) -> 'ModelWithFlagQuerySet':
+        """Filters objects flagged by the user.
+
+        :param user:
+        :param status: Optional status filter. Status or a sequence of statuses.
+
+        """
+        return self.filter(Exists(self._get_flags(user=user, status=status)))
+
+    def not_flagged_by(self, user: 'User', *, status: TypeStatus = None) -> 'ModelWithFlagQuerySet':
+        """Filters objects not flagged by the user.
+
+        :param user:
+        :param status: Optional status filter. Status or a sequence of statuses.
+
+        """
+        return self.filter(~Exists(self._get_flags(user=user, status=status)))
+
+    def delete_with_flags(self) -> Tuple[int, Dict[str, int]]:
+        """Deletes objects along with their flags.
+
+        Flags are removed beforehand with a single query (objects are not loaded for that),
+        keeping flag counters and cache consistent, which plain `delete()` does not.
+
+        Returns the same as `delete()`, including a number of flags removed.
+
+        """
+        content_type_id = get_content_type_id(self.model)
+        flag_model = get_flag_model()
+
+        with transaction.atomic(using=self.db):
+            removed = delete_flags(
+                flag_model.objects.filter(content_type_id=content_type_id, object_id__in=self.values('pk')),
+                content_type_id=content_type_id)
+
+            token = _DELETING_WITH_FLAGS.set(True)
+
+            try:
+                deleted, counts = self.delete()
+
+            finally:
+                _DELETING_WITH_FLAGS.reset(token)
+
+        if removed:
+            counts[flag_model._meta.label] = removed
+            deleted += removed
+
+            flags_cache = get_flags_cache()
+
+            if flags_cache:
+                flags_cache.invalidate_all()
+
+        return deleted, counts
+
+
+class ModelWithFlag(models.Model):
+    """Helper base class for models with flags.
+
+    Inherit from this model to be able to mark model instances.
+
+    """
+    flags = GenericRelation(MODEL_FLAG)
+
+    objects = ModelWithFlagQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def get_flags_for_type(
+            cls,
+            mdl_classes: List[Type[models.Model]] = None,
+            *,
+            user: 'User' = None,
+            status: int = None,
+            allow_empty: bool = True,
+            with_objects: TypeWithObjects = False,
+            lightweight: bool = False,
+
+    ) -> Union[TypeFlagsForTypes, TypeFlagsForType]:
+        """Returns a dictionary with flag objects associated with
+        the given model classes (types) if mdl_classes is given.
+        The dictionary is indexed by model classes.
+        Each dict entry contains a list of associated flag objects.
+
+        If mdl_classes is not given, returns a list of associated
+        flag objects for this very class.
+
+        :param mdl_classes: Types to get flags for. If not set the current class is used.
+        :param user: User filter,
+        :param status: Status filter
+        :param allow_empty: Flag. Include results for all given types, even those without associated flags.
+        :param with_objects: Whether to fetch the flagged objects along with the flags.
+            May be a dictionary of querysets indexed by models, to fetch objects
+            using those (e.g. to apply select_related() or only()).
+        :param lightweight: Return `FlagRecord` tuples instead of flag model objects.
+
+        """
+        model: FlagBase = get_model_class_from_string(MODEL_FLAG)
+
+        single_type = False
+        if mdl_classes is None:
+            mdl_classes = [cls]
+            single_type = True
+            allow_empty = True
+
+        result = model.get_flags_for_types(
+            mdl_classes,
+            user=user,
+            status=status,
+            allow_empty=allow_empty,
+            with_objects=with_objects,
+            lightweight=lightweight,
+        )
+
+        if single_type:
+            result = result[cls]
+
+        return result
+
+    get_flags_for_types = get_flags_for_type  # alias
+
+    @classmethod
+    async def aget_flags_for_type(
+            cls,
+            mdl_classes: List[Type[models.Model]] = None,
+            *,
+            user: 'User' = None,
+            status: int = None,
+            allow_empty: bool = True,
+            with_objects: TypeWithObjects = False,
+
+    ) -> Union[TypeFlagsForTypes, TypeFlagsForType]:
+        """Asynchronous version of `get_flags_for_type()`.
+
+        :param mdl_classes: Types to get flags for. If not set the current class is used.
+        :param user: User filter,
+        :param status: Status filter
+        :param allow_empty: Flag. Include results for all given types, even those without associated flags.
+        :param with_objects: Whether to fetch the flagged objects along with the flags.
+            May be a dictionary of querysets indexed by models, to fetch objects
+            using those (e.g. to apply select_related() or only()).
+
+        """
+        single_type = False
+        if mdl_classes is None:
+            mdl_classes = [cls]
+            single_type = True
+            allow_empty = True
+
+        result = await get_flag_model().aget_flags_for_types(
+            mdl_classes,
+            user=user,
+            status=status,
+            allow_empty=allow_empty,
+            with_objects=with_objects,
+        )
+
+        if single_type:
+            result = result[cls]
+
+        return result
+
+    aget_flags_for_types = aget_flags_for_type  # alias
+
+    @classmethod
+    def iter_flags_for_types(
+            cls,
+            mdl_classes: List[Type[models.Model]] = None,
+            *,
+            user: 'User' = None,
+            status: int = None,
+            with_objects: TypeWithObjects = False,
+            batch_size: int = 1000,
+            after: TypeCursor = None,
+
+    ) -> Iterator[TypeFlagsForTypes]:
+        """Iterates over flag objects associated with the given model classes (types)
+        in batches, newest first, not loading all the flags into memory at once.
+
+        Yields dictionaries indexed by model classes.
+        Each dict entry contains a list of associated flags from a batch.
+
+        :param mdl_classes: Types to get flags for. If not set the current class is used.
+        :param user: User filter,
+        :param status: Status filter
+        :param with_objects: Whether to fetch the flagged objects along with the flags.
+            May be a dictionary of querysets indexed by models, to fetch objects
+            using those (e.g. to apply select_related() or only()).
+        :param batch_size: Number of flags to fetch at once.
+        :param after: Cursor. Iterate over flags older than a flag with this cursor.
+
+        """
+        yield from get_flag_model().iter_flags_for_types(
+            mdl_classes or [cls],
+            user=user,
+            status=status,
+            with_objects=with_objects,
+            batch_size=batch_size,
+            after=after,
+        )
+
+    @classmethod
+    def get_flags_for_objects(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            user: 'User' = None,
+            status: TypeStatus = None,
+            lightweight: bool = False,
+            key_by_model: bool = False,
+
+    ) -> Dict[Union[int, Tuple[Type[models.Model], int]], TypeFlagsForType]:
+        """Returns a dictionary with flag objects associated with the given model objects.
+        The dictionary is indexed by objects IDs.
+        Each dict entry contains a list of associated flag objects.
+
+        :param objects_list: Objects to get flags for. May be of different types.
+        :param user:
+        :param status: Status or a sequence of statuses.
+        :param lightweight: Return `FlagRecord` tuples instead of flag model objects.
+        :param key_by_model: Index the dictionary by (model class, object ID) tuples.
+            Useful for objects of different types, since their IDs may clash.
+
+        """
+        model: FlagBase = get_model_class_from_string(MODEL_FLAG)
+        return model.get_flags_for_objects(
+            objects_list, user=user, status=status, lightweight=lightweight, key_by_model=key_by_model)
+
+    @classmethod
+    async def aget_flags_for_objects(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            user: 'User' = None,
+            status: TypeStatus = None,
+            key_by_model: bool = False,
+
+    ) -> Dict[Union[int, Tuple[Type[models.Model], int]], TypeFlagsForType]:
+        """Asynchronous version of `get_flags_for_objects()`.
+
+        :param objects_list: Objects to get flags for. May be of different types.
+        :param user:
+        :param status: Status or a sequence of statuses.
+        :param key_by_model: Index the dictionary by (model class, object ID) tuples.
+
+        """
+        return await get_flag_model().aget_flags_for_objects(
+            objects_list, user=user, status=status, key_by_model=key_by_model)
+
+    @classmethod
+    def set_flags_for_objects(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            user: 'User',
+            note: str = None,
+            status: int = None
+
+    ) -> int:
+        """Flags all the given objects at once. Returns a number of flags created.
+
+        :param objects_list: Objects to flag. May be of different types.
+        :param user:
+        :param note: User-defined note for flags.
+        :param status: Optional status integer (the meaning is defined by a developer).
+
+        """
+        return get_flag_model().set_flags_for_objects(objects_list, user=user, note=note, status=status)
+
+    @classmethod
+    def remove_flags_for_objects(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            user: 'User' = None,
+            status: int = None
+
+    ) -> int:
+        """Removes flags from all the given objects at once. Returns a number of flags removed.
+
+        :param objects_list: Objects to remove flags from. May be of different types.
+        :param user: Optional user filter
+        :param status: Optional status filter
+
+        """
+        return get_flag_model().remove_flags_for_objects(objects_list, user=user, status=status)
+
+    @classmethod
+    def get_flag_counts_for_objects(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            status: int = None
+
+    ) -> Dict[int, int]:
+        """Returns a dictionary with flags counts for the given model objects.
+        The dictionary is indexed by objects IDs.
+
+        :param objects_list: Homogeneous objects list.
+        :param status: Optional status filter. If not set counts for all statuses are summed up.
+
+        """
+        return get_flag_model().get_flag_counts_for_objects(objects_list, status=status)
+
+    @classmethod
+    def get_flag_statuses_for_objects(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            user: 'User' = None,
+            status: TypeStatus = None
+
+    ) -> Dict[int, Dict[Optional[int], int]]:
+        """Returns a dictionary with flags counts by statuses for the given model objects
+        using a single aggregate query.
+
+        The dictionary is indexed by objects IDs. Each dict entry
+        is a dictionary of flags counts indexed by statuses (only those with flags).
+
+        :param objects_list: Homogeneous objects list.
+        :param user: Optional user filter
+        :param status: Optional status filter. Status or a sequence of statuses.
+
+        """
+        return get_flag_model().get_flag_statuses_for_objects(objects_list, user=user, status=status)
+
+    @classmethod
+    def filter_flagged_ids(cls, objects_ids: Sequence[int], *, user: 'User', status: TypeStatus = None) -> List[int]:
+        """Returns those of the given objects IDs which are flagged by the user (preserving order).
+
+        :param objects_ids: IDs of objects of this type.
+        :param user:
+        :param status: Optional status filter. Status or a sequence of statuses.
+
+        """
+        return get_flag_model().filter_flagged_ids(cls, objects_ids, user=user, status=status)
+
+    @classmethod
+    def get_top_flagged(
+            cls,
+            *,
+            status: TypeStatus = None,
+            since: datetime = None,
+            limit: int = 10,
+            with_objects: bool = False
+
+    ) -> List[Tuple[Union[int, 'ModelWithFlag'], int]]:
+        """Returns a list of the most flagged objects of this type
+        as (object ID, flags count) tuples ordered by count (descending).
+
+        :param status: Optional status filter. Status or a sequence of statuses.
+        :param since: Only count flags created since this time.
+        :param limit: Maximum number of objects to return.
+        :param with_objects: Return objects instead of their IDs.
+
+        """
+        return get_flag_model().get_top_flagged(
+            cls, status=status, since=since, limit=limit, with_objects=with_objects)
+
+    @classmethod
+    @instrumented('prefetch_flags', subject='objects_list')
+    def prefetch_flags(
+            cls,
+            objects_list: Union[QuerySet, Sequence],
+            *,
+            user: 'User' = None,
+            status: TypeStatus = None
+
+    ) -> Sequence['ModelWithFlag']:
+        """Fetches flags for all the given objects using a single query
+        and attaches them to the objects. Returns the objects.
+
+        After that ``get_flags()`` and ``is_flagged()`` of those objects are
+        served from memory unless they ask for something not prefetched
+        (e.g. for another user or status).
+
+        :param objects_list: Homogeneous objects list.
+        :param user: Optional user filter
+        :param status: Optional status filter. Status or a sequence of statuses.
+
+        """
+        objects_list = list(objects_list)
+
+        if user and not user.id:
+            return objects_list
+
+        flags = get_flag_model().get_flags_for_objects(objects_list, user=user, status=status)
+
+        prefetched_user = None if user is None else user.id
+        prefetched_statuses = get_statuses_set(status)
+
+        for obj in objects_list:
+            setattr(obj, PREFETCHED_FLAGS_ATTR, (prefetched_user, prefetched_statuses, flags.get(obj.pk, [])))
+
+        return objects_list
+
+    def _get_prefetched_flags(self, user: Optional['User'], status: Optional[TypeStatus]) -> Optional[List[FlagBase]]:
+        """Returns prefetched flags matching the given filters
+        or None if prefetched flags are not available for them.
+
+        :param user:
+        :param status: Status or a sequence of statuses.
+
+        """
+        prefetched = self.__dict__.get(PREFETCHED_FLAGS_ATTR)
+
+        if prefetched is None:
+            return None
+
+        prefetched_user, prefetched_statuses, flags = prefetched
+
+        user_id = None if user is None else user.id
+
+        if prefetched_user is not None and prefetched_user != user_id:
+            return None
+
+        statuses = get_statuses_set(status)
+
+        if prefetched_statuses is not None and (statuses is None or not statuses <= prefetched_statuses):
+            return None
+
+        return [
+            flag for flag in flags
+            if (user_id is None or flag.user_id == user_id) and (statuses is None or flag.status in statuses)
+        ]
+
+    @instrumented('get_flags')
+    def get_flags(self, user: 'User' = None, *, status: int = None) -> Union[QuerySet, Sequence[FlagBase]]:
+        """Returns flags for the object optionally filtered by status.
+
+        Returns a queryset, or a list if flags are prefetched (see `prefetch_flags()`)
+        or caching is enabled with SITEFLAGS_CACHE setting.
+
+        :param user: Optional user filter
+        :param status: Optional status filter
+
+        """
+        flags = self._get_prefetched_flags(user, status)
+
+        if flags is not None:
+            return flags
+
+        def get_flags():
+            return self._get_flags_queryset(get_content_type_id(self), user=user, status=status)
+
+        return self._get_cached('flags', user=user, status=status, func=lambda: list(get_flags()), default=get_flags)
+
+    def _get_cached(self, kind: str, *, user: Optional['User'], status: Optional[int], func: Callable, default: Callable):
+        """Returns a value from flags cache if caching is enabled.
+        Calls the given function to get the value to put into cache on a miss.
+
+        :param kind: Entry kind (e.g. flags, count).
+        :param user:
+        :param status:
+        :param func: Function returning a value to cache.
+        :param default: Function returning a value if caching is disabled.
+
+        """
+        flags_cache = get_flags_cache()
+
+        if not flags_cache:
+            return default()
+
+        cache_key = flags_cache.get_objects_keys(
+            kind, get_content_type_id(self), [self.pk],
+            user_id=user.id if user else None,
+            status=status,
+        )[self.pk]
+
+        value = flags_cache.get(cache_key)
+
+        if value is None:
+            value = func()
+            flags_cache.set(cache_key, value)
+
+        return value
+
+    @instrumented('set_flag')
+    def set_flag(
+            self,
+            user: 'User',
+            *,
+            note: str = None,
+            status: int = None,
+            if_exists: str = None
+
+    ) -> Optional[FlagBase]:
+        """Flags the object.
+
+        :param user:
+        :param note: User-defined note for this flag.
+        :param status: Optional status integer (the meaning is defined by a developer).
+        :param if_exists: What to do if the flag already exists:
+            * None - do nothing and return None;
+            * ignore - keep the existing flag;
+            * update_note - update note of the existing flag.
+
+            If set, the flag is written without relying on DB integrity errors
+            (using INSERT ... ON CONFLICT where supported), and the stored flag is returned.
+
+        Flags with statuses from SITEFLAGS_BUFFER_STATUSES setting are buffered
+        and written later in bulk (unless a note is to be updated). A flag object (not saved)
+        is returned for them.
+
+        """
+        if if_exists not in IF_EXISTS_CHOICES:
+            raise ValueError(f"Unsupported 'if_exists' value: {if_exists}")
+
+        if not user.id:
+            return None
+
+        content_type_id = get_content_type_id(self)
+        flag = self._make_flag(content_type_id, user=user, note=note, status=status)
+        forget_prefetched_flags([self])
+
+        if status is not None and status in siteflags_settings.BUFFER_STATUSES and if_exists != 'update_note':
+            get_flags_buffer().add(flag)
+            return flag
+
+        if if_exists is None:
+
+            try:
+                with transaction.atomic():
+                    flag.save()
+
+                    if siteflags_settings.COUNTERS:
+                        FlagCounter.update_counts(content_type_id, [self.pk], status=status, delta=1)
+
+            except IntegrityError:  # Record already exists.
+                return None
+
+        else:
+            updated = 0
+
+            if if_exists == 'update_note' and note is not None:
+                updated = self._get_flags_queryset(
+                    content_type_id, user=user, status=status, exact=True).update(note=note)
+
+            if not updated:
+                insert_flag(flag)
+
+            if flag.pk is None:
+                # Not inserted (or inserted without getting an ID): read the stored flag.
+                flag = self._get_flags_queryset(content_type_id, user=user, status=status, exact=True).first()
+
+        invalidate_flags_cache(content_type_id, [self.pk], user_id=user.id)
+
+        return flag
+
+    @instrumented('toggle_flag')
+    def toggle_flag(self, user: 'User', *, note: str = None, status: int = None) -> bool:
+        """Flags the object if it is not flagged by the user with the given status,
+        otherwise removes the flag. Returns a boolean whether the object is flagged now.
+
+        :param user:
+        :param note: User-defined note for a new flag.
+        :param status: Optional status integer (the meaning is defined by a developer).
+
+        """
+        if not user.id:
+            return False
+
+        content_type_id = get_content_type_id(self)
+        forget_prefetched_flags([self])
+
+        # Removal goes first: it tells whether the flag existed without a separate query.
+        removed = get_flags_buffer().discard(content_type_id, [self.pk], user_id=user.id, status=status)
+        removed += delete_flags(
+            self._get_flags_queryset(content_type_id, user=user, status=status, exact=True),
+            content_type_id=content_type_id)
+
+        if not removed:
+            insert_flag(self._make_flag(content_type_id, user=user, note=note, status=status))
+
+        invalidate_flags_cache(content_type_id, [self.pk], user_id=user.id)
+
+        return not removed
+
+    @instrumented('remove_flag')
+    def remove_flag(self, user: 'User' = None, *, status: int = None):
+        """Removes flag(s) from the object.
+
+        :param user: Optional user filter
+        :param status: Optional status filter
+
+        """
+        content_type_id = get_content_type_id(self)
+        if user is None or user.id:
+            get_flags_buffer().discard(content_type_id, [self.pk], user_id=user.id if user else None, status=status)
+
+        delete_flags(
+            self._get_flags_queryset(content_type_id, user=user, status=status),
+            content_type_id=content_type_id)
+        forget_prefetched_flags([self])
+        invalidate_flags_cache(content_type_id, [self.pk], user_id=user.id if user else None)
+
+    @instrumented('is_flagged')
+    def is_flagged(self, user: 'User' = None, *, status: int = None) -> int:
+        """Returns a number of times the object is flagged by a user.
+
+        :param user: Optional user filter
+        :param status: Optional status filter
+
+        """
+        if user and user.is_anonymous:
+            return False
+
+        flags = self._get_prefetched_flags(user, status)
+
+        if flags is not None:
+            return len(flags)
+
+        def count():
+            if user is None and siteflags_settings.COUNTERS:
+                return self.get_flag_counts_for_objects([self], status=status)[self.pk]
+
+            return self._get_flags_queryset(get_content_type_id(self), user=user, status=status).count()
+
+        return self._get_cached('count', user=user, status=status, func=count, default=count)
+
+    @instrumented('get_flag_statuses')
+    def get_flag_statuses(self, user: 'User' = None, *, status: TypeStatus = None) -> Dict[Optional[int], int]:
+        """Returns a dictionary of flags counts indexed by statuses (only those with flags)
+        for the object, using a single query.
+
+        :param user: Optional user filter
+        :param status: Optional status filter. Status or a sequence of statuses.
+
+        """
+        if user and user.is_anonymous:
+            return {}
+
+        flags = self._get_prefetched_flags(user, status)
+
+        if flags is not None:
+            counts = defaultdict(int)
+
+            for flag in flags:
+                counts[flag.status] += 1
+
+            return dict(counts)
+
+        def get_statuses():
+            return self.get_flag_statuses_for_objects([self], user=user, status=status)[self.pk]
+
+        return self._get_cached('statuses', user=user, status=status, func=get_statuses, default=get_statuses)
+
+    @instrumented('aget_flags')
+    async def aget_flags(self, user: 'User' = None, *, status: int = None) -> List[FlagBase]:
+        """Asynchronous version of `get_flags()`.
+
+        :param user: Optional user filter
+        :param status: Optional status filter
+
+        """
+        flags = self._get_prefetched_flags(user, status)
+
+        if flags is not None:
+            return flags
+
+        if use_sync_api():
+            return await sync_to_async(lambda: list(self.get_flags(user, status=status)))()
+
+        content_type_id = await aget_content_type_id(self)
+
+        return [flag async for flag in self._get_flags_queryset(content_type_id, user=user, status=status)]
+
+    @instrumented('aset_flag')
+    async def aset_flag(self, user: 'User', *, note: str = None, status: int = None) -> Optional[FlagBase]:
+        """Asynchronous version of `set_flag()`.
+
+        :param user:
+        :param note: User-defined note for this flag.
+        :param status: Optional status integer (the meaning is defined by a developer).
+
+        """
+        if use_sync_api():
+            return await sync_to_async(self.set_flag)(user, note=note, status=status)
+
+        if not user.id:
+            return None
+
+        flag = self._make_flag(await aget_content_type_id(self), user=user, note=note, status=status)
+        forget_prefetched_flags([self])
+
+        if status is not None and status in siteflags_settings.BUFFER_STATUSES:
+            flags_buffer = get_flags_buffer()
+            flags_buffer.add(flag, flush=False)
+
+            if flags_buffer.is_full():
+                await sync_to_async(flags_buffer.flush)()
+
+            return flag
+
+        try:
+            await flag.asave()
+
+        except IntegrityError:  # Record already exists.
+            return None
+
+        return flag
+
+    @instrumented('aremove_flag')
+    async def aremove_flag(self, user: 'User' = None, *, status: int = None):
+        """Asynchronous version of `remove_flag()`.
+
+        :param user: Optional user filter
+        :param status: Optional status filter
+
+        """
+        if use_sync_api():
+            return await sync_to_async(self.remove_flag)(user, status=status)
+
+        content_type_id = await aget_content_type_id(self)
+        if user is None or user.id:
+            get_flags_buffer().discard(content_type_id, [self.pk], user_id=user.id if user else None, status=status)
+
+        await self._get_flags_queryset(content_type_id, user=user, status=status).adelete()
+        forget_prefetched_flags([self])
+
+    @instrumented('ais_flagged')
+    async def ais_flagged(self, user: 'User' = None, *, status: int = None) -> int:
+        """Asynchronous version of `is_flagged()`.
+
+        :param user: Optional user filter
+        :param status: Optional status filter
+
+        """
+        if user and user.is_anonymous:
+            return False
+
+        flags = self._get_prefetched_flags(user, status)
+
+        if flags is not None:
+            return len(flags)
+
+        if use_sync_api():
+            return await sync_to_async(self.is_flagged)(user, status=status)
+
+        content_type_id = await aget_content_type_id(self)
+
+        return await self._get_flags_queryset(content_type_id, user=user, status=status).acount()
+
+    def _get_flags_queryset(
+            self,
+            content_type_id: int,
+            *,
+            user: Optional['User'],
+            status: Optional[TypeStatus],
+            exact: bool = False
+
+    ) -> QuerySet:
+        """Returns a queryset for flags of the object.
+
+        :param content_type_id: Object content type ID.
+        :param user:
+        :param status:
+        :param exact: Match no status if status is not set (instead of any status).
+
+        """
+        filter_kwargs = {
+            'content_type_id': content_type_id,
+            'object_id': self.pk,
+        }
+        update_filter_dict(filter_kwargs, user=user, status=status)
+
+        if exact and status is None:
+            filter_kwargs['status__isnull'] = True
+
+        return get_flag_model().objects.filter(**filter_kwargs)
+
+    def _make_flag(self, content_type_id: int, *, user: 'User', note: Optional[str], status: Optional[int]) -> FlagBase:
+        """Returns a new (not saved) flag for the object.
+
+        :param content_type_id: Object content type ID.
+        :param user:
+        :param note:
+        :param status:
+
+        """
+        init_kwargs = {
+            'user': user,
+            'content_type_id': content_type_id,
+            'object_id': self.pk,
+        }
+        if note is not None:
+            init_kwargs['note'] = note
+
+        if status is not None:
+            init_kwargs['status'] = status
+
+        return get_flag_model()(**init_kwargs)
+
+
+def use_sync_api() -> bool:
+    """Helper. Whether asynchronous API should fall back to synchronous one
+    (run in a thread), since some enabled features (caching, counters)
+    are not available asynchronously.
+
+    """
+    return bool(siteflags_settings.CACHE or siteflags_settings.COUNTERS)
+
+
+def update_filter_dict(d: dict, *, user: Optional['User'], status: Optional[TypeStatus]):
+    """Helper. Updates filter dict for a queryset.
+
+    :param d:
+    :param user:
+    :param status: Status or a sequence of statuses.
+
+    """
+    if user is not None:
+
+        if not user.id:
+            return None
+
+        d['user'] = user
+
+    if status is not None:
+
+        if isinstance(status, int):
+            d['status'] = status
+
+        else:
+            d['status__in'] = status
+
+
+def load_linked_objects(
+        flags: Sequence[FlagBase],
+        *,
+        querysets: TypeWithObjects = None
+
+) -> Sequence[FlagBase]:
+    """Fetches objects linked to the given flags (available as `flag.linked_object`)
+    using one query per objects type. Returns the same flags.
+
+    Unlike generic relation prefetching this allows using custom querysets.
+
+    :param flags:
+    :param querysets: Querysets indexed by models to fetch objects using those
+        (e.g. to apply select_related() or only()). Default managers are used for other models.
+
+    """
+    if not isinstance(querysets, dict):
+        querysets = {}
+
+    grouped = defaultdict(set)
+
+    for flag in flags:
+        grouped[flag.content_type_id].add(flag.object_id)
+
+    objects = {}
+    content_types = ContentType.objects
+
+    for content_type_id, objects_ids in grouped.items():
+        model = content_types.get_for_id(content_type_id).model_class()
+
+        if model is None:  # Stale content type.
+            objects[content_type_id] = {}
+            continue
+
+        queryset = querysets.get(model)
+
+        if queryset is None:
+            queryset = model._default_manager.all()
+
+        objects[content_type_id] = queryset.in_bulk(objects_ids)
+
+    for flag in flags:
+        # Populate generic foreign key cache. Cached None (object is missing or filtered out)
+        # is honoured by GenericForeignKey since Django 4.2, so that it's not fetched again.
+        flag._meta.get_field('linked_object').set_cached_value(
+            flag, objects[flag.content_type_id].get(flag.object_id))
+
+    return flags
+
+
+def iter_flags(flags: QuerySet, *, lightweight: bool) -> Iterable[Union[FlagBase, FlagRecord]]:
+    """Helper. Returns an iterable over flags from the given queryset.
+
+    :param flags:
+    :param lightweight: Fetch only `FlagRecord` fields (no `note`, no model instances).
+
+    """
+    if lightweight:
+        return map(FlagRecord._make, flags.values_list(*FlagRecord._fields))
+
+    return flags
+
+
+def get_cursor_filter(cursor: TypeCursor) -> Q:
+    """Helper. Returns a filter to get flags following (older than) a flag with the given cursor.
+
+    :param cursor: Flag cursor (see FlagBase.get_cursor()).
+
+    """
+    time_created, flag_id = cursor
+    return Q(time_created__lt=time_created) | Q(time_created=time_created, id__lt=flag_id)
+
+
+def insert_flag(flag: FlagBase):
+    """Helper. Inserts the given flag ignoring conflicts with an existing one
+    (using INSERT ... ON CONFLICT where supported), updating flag counters if enabled.
+
+    :param flag:
+
+    """
+    if not siteflags_settings.COUNTERS:
+        type(flag).objects.bulk_create([flag], ignore_conflicts=True)
+        return
+
+    # Counters are only to be updated if the flag is actually inserted.
+    try:
+        with transaction.atomic():
+            flag.save()
+            FlagCounter.update_counts(flag.content_type_id, [flag.object_id], status=flag.status, delta=1)
+
+    except IntegrityError:
+        pass
+
+
+def delete_flags(flags: QuerySet, *, content_type_id: int) -> int:
+    """Helper. Deletes the given flags updating flag counters if enabled.
+    Returns a number of flags deleted.
+
+    :param flags: Flags of objects of the same content type.
+    :param content_type_id:
+
+    """
+    if not siteflags_settings.COUNTERS:
+        return flags.delete()[0]
+
+    with transaction.atomic():
+        counts = list(flags.values('object_id', 'status').annotate(cnt=Count('id')).order_by())
+        deleted = flags.delete()[0]
+
+        grouped = defaultdict(list)
+        for item in counts:
+            grouped[(item['status'], item['cnt'])].append(item['object_id'])
+
+        for (status, cnt), objects_ids in grouped.items():
+            FlagCounter.update_counts(content_type_id, objects_ids, status=status, delta=-cnt)
+
+    return deleted
+
+
+def get_duplicate_flags(flag_model: Type[FlagBase]) -> QuerySet:
+    """Helper. Returns duplicate flags without status
+    (all but the oldest one for an object and a user).
+
+    :param flag_model:
+
+    """
+    older = flag_model.objects.filter(
+        content_type_id=OuterRef('content_type_id'),
+        object_id=OuterRef('object_id'),
+        user_id=OuterRef('user_id'),
+        status__isnull=True,
+        id__lt=OuterRef('id'),
+    )
+    return flag_model.objects.filter(Exists(older), status__isnull=True)
+
+
+def get_statuses_set(status: Optional[TypeStatus]) -> Optional[Set[int]]:
+    """Helper. Returns a set of statuses for the given status or a sequence of statuses.
+
+    :param status:
+
+    """
+    if status is None:
+        return None
+
+    return {status} if isinstance(status, int) else set(status)
+
+
+def forget_prefetched_flags(objects_list: Union[QuerySet, Sequence]):
+    """Helper. Drops flags prefetched for the given objects
+    so that they are not used after flags modification.
+
+    :param objects_list:
+
+    """
+    for obj in objects_list:
+        obj.__dict__.pop(PREFETCHED_FLAGS_ATTR, None)
+
+
+def group_objects_by_type(
+        objects_list: Union[QuerySet, Sequence],
+        *,
+        for_concrete_models: bool = True
+
+) -> Dict[int, List[int]]:
+    """Helper. Groups objects IDs by objects content types IDs.
+
+    :param objects_list:
+    :param for_concrete_models: Use content types of concrete models for proxy models.
+
+    """
+    grouped = defaultdict(dict)  # Dicts are used to deduplicate IDs respecting their order.
+
+    for obj in objects_list:
+        grouped[get_content_type_id(obj, for_concrete_model=for_concrete_models)][obj.pk] = None
+
+    return {content_type_id: list(objects_ids) for content_type_id, objects_ids in grouped.items()}
+
+
+def get_objects_filter(grouped: Dict[int, List[int]]) -> Q:
+    """Helper. Returns a filter for flags of objects grouped by content types.
+
+    :param grouped: Objects IDs indexed by content types IDs (see `group_objects_by_type()`).
+
+    """
+    objects_filter = Q()
+
+    for content_type_id, objects_ids in grouped.items():
+        if objects_ids:
+            objects_filter |= Q(content_type_id=content_type_id, object_id__in=objects_ids)
+
+    return objects_filter
+
+
+def get_objects_result(
+        objects_list: Sequence,
+        flags_dict: Dict[Tuple[int, int], TypeFlagsForType],
+        *,
+        key_by_model: bool
+
+) -> Dict[Union[int, Tuple[Type[models.Model], int]], TypeFlagsForType]:
+    """Helper. Returns flags for the given objects indexed by objects IDs
+    or by (model class, object ID) tuples.
+
+    :param objects_list:
+    :param flags_dict: Flags indexed by (content type ID, object ID) tuples.
+    :param key_by_model:
+
+    """
+    result = {}
+
+    for obj in objects_list:
+        flags = flags_dict.get((get_content_type_id(obj, for_concrete_model=False), obj.pk), [])
+        result[(type(obj), obj.pk) if key_by_model else obj.pk] = flags
+
+    return result
+
+
+def remove_object_flags(sender, instance: ModelWithFlag, **kwargs):
+    """Signal handler. Removes flags of an object being deleted through siteflags API,
+    so that flag counters and cache are kept consistent (unlike with GenericRelation cascade).
+
+    :param sender:
+    :param instance:
+
+    """
+    if _DELETING_WITH_FLAGS.get():
+        return
+
+    if siteflags_settings.COUNTERS or siteflags_settings.CACHE:
+        instance.remove_flag()
+
+
+def remove_user_flags(sender, instance: 'User', **kwargs):
+    """Signal handler. Removes flags of a user being deleted,
+    so that flag counters and cache are kept consistent (unlike with FK cascade).
+
+    :param sender:
+    :param instance:
+
+    """
+    if not (siteflags_settings.COUNTERS or siteflags_settings.CACHE):
+        return
+
+    flags = get_flag_model().objects.filter(user_id=instance.pk)
+    content_types_ids = list(flags.order_by().values_list('content_type_id', flat=True).distinct())
+
+    for content_type_id in content_types_ids:
+        delete_flags(flags.filter(content_type_id=content_type_id), content_type_id=content_type_id)
+
+    if content_types_ids:
+        flags_cache = get_flags_cache()
+
+        if flags_cache:
+            flags_cache.invalidate_all()
@@ -3,3 +3,62 @@ from django.conf import settings
 
 MODEL_FLAG = getattr(settings, 'SITEFLAGS_FLAG_MODEL', 'siteflags.Flag')
 """Dotted path to a Flag custom model in form of `app.Model`."""
+
+CACHE = getattr(settings, 'SITEFLAGS_CACHE', None)
+"""Alias of a cache (from CACHES setting) to cache flags lookups in, e.g. `default`.
+Caching is disabled if not set.
+
+"""
+
+CACHE_TIMEOUT = getattr(settings, 'SITEFLAGS_CACHE_TIMEOUT', 3600)
+"""Number of seconds to keep cached flags lookups results for. None - forever."""
+
+COUNTERS = getattr(settings, 'SITEFLAGS_COUNTERS', False)
+"""Whether to maintain denormalized flags counts (FlagCounter model)
+on flags modification. Those are used to count flags without a user filter.
+
+Use `siteflags_rebuild_counters` management command after enabling.
+
+"""
+
+WARM_CONTENT_TYPES = getattr(settings, 'SITEFLAGS_WARM_CONTENT_TYPES', True)
+"""Whether to resolve content types for all models with flags on the first request
+(not to query DB on application start), so that flags lookups do not need to query for content types.
+
+"""
+
+RETENTION = getattr(settings, 'SITEFLAGS_RETENTION', {})
+"""Flags time to live by statuses (None for flags without status), e.g. `{FLAG_SEEN: timedelta(days=30)}`.
+Values are timedelta objects or numbers of seconds.
+
+Expired flags are removed with `siteflags_purge_expired` management command.
+
+"""
+
+ARCHIVE = getattr(settings, 'SITEFLAGS_ARCHIVE', False)
+"""Whether to move expired flags into archive (FlagArchive model) instead of just deleting them."""
+
+BUFFER_STATUSES = getattr(settings, 'SITEFLAGS_BUFFER_STATUSES', ())
+"""Statuses of flags to be buffered by `set_flag()` and written later in bulk (write-behind), e.g. `[FLAG_SEEN]`.
+Useful for flags set on almost every request.
+
+Buffered flags are kept in process memory, so that they are lost if the process
+is killed before they are written, and they are not seen by lookups until then.
+
+"""
+
+BUFFER_SIZE = getattr(settings, 'SITEFLAGS_BUFFER_SIZE', 500)
+"""Number of buffered flags to write them at."""
+
+BUFFER_TIMEOUT = getattr(settings, 'SITEFLAGS_BUFFER_TIMEOUT', 10)
+"""Max number of seconds to keep flags in buffer for. Checked by `FlagsBufferMiddleware`
+at the end of a request (not on flag setting), so 0 means writing buffered flags
+at the end of every request.
+
+"""
+
+ADMIN_DATE_HIERARCHY = getattr(settings, 'SITEFLAGS_ADMIN_DATE_HIERARCHY', True)
+"""Whether to show date hierarchy for flags in admin.
+Date hierarchy requires scanning for distinct dates, that could be slow on huge tables.
+
+"""
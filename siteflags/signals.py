@@ -0,0 +1,26 @@
+from django.dispatch import Signal
+
+sig_flags_operation = Signal()
+"""Sent after a flags operation (e.g. set_flag, get_flags_for_types) is performed.
+
+Keyword arguments:
+
+* operation: str - operation name
+* content_types: List[int] - IDs of content types the operation has dealt with
+* rows: Optional[int] - number of flags (or objects) affected or returned; None if unknown (lazy results)
+* queries: Optional[int] - number of DB queries issued; None for asynchronous operations
+* duration: float - wall time in seconds
+
+Nested operations (issued by other operations) are not reported.
+
+"""
+
+sig_flags_metrics_collected = Signal()
+"""Sent by FlagsMetricsMiddleware after a request is processed.
+
+Keyword arguments:
+
+* request: HttpRequest
+* metrics: FlagsMetrics - totals for flags operations performed during the request
+
+"""
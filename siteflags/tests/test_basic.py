@@ -1,8 +1,10 @@
+import re
 from uuid import uuid4
 
 import pytest
 
 from siteflags.models import ModelWithFlag
+from siteflags.utils import get_flag_model
 
 
 @pytest.fixture
@@ -29,6 +31,39 @@ def create_article():
     return create_article_
 
 
+@pytest.fixture
+def enable_counters(monkeypatch):
+    from siteflags import settings
+    from siteflags.models import FlagCounter
+
+    def enable_counters_():
+        monkeypatch.setattr(settings, 'COUNTERS', True)
+        FlagCounter.rebuild()
+
+    return enable_counters_
+
+
+@pytest.fixture
+def count_flag_queries(db_queries):
+
+    def count_flag_queries_(func):
+        db_queries.clear()
+        result = func()
+        return result, len([sql for sql in db_queries.sql() if 'siteflags_flag' in sql])
+
+    return count_flag_queries_
+
+
+@pytest.fixture
+def dump_flags():
+
+    def dump_flags_():
+        return sorted(get_flag_model().objects.values_list(
+            'content_type_id', 'object_id', 'user_id', 'status', 'note', 'time_created'), key=str)
+
+    return dump_flags_
+
+
 class TestModelWithFlag:
 
     def test_get_flags_for_types(self, user, user_create, create_comment, create_article, db_queries):
@@ -69,7 +104,64 @@ class TestModelWithFlag:
         assert len(db_queries) == 2
         assert len(set(titles)) == 2
 
-    def test_get_flags_for_objects(self, user, user_create, create_article):
+        # Custom querysets.
+        db_queries.clear()
+        flags = ModelWithFlag.get_flags_for_types(
+            [Article, Comment], with_objects={Article: Article.objects.only('id')})
+        assert len(db_queries) == 3
+        assert {flag.linked_object for flag in flags[Comment]} == {comment_1, comment_2}
+        assert {flag.linked_object.get_deferred_fields() == {'title'} for flag in flags[Article]} == {True}
+        assert len(db_queries) == 3
+
+        # Objects not found.
+        flags = ModelWithFlag.get_flags_for_types(
+            [Comment], status=44, with_objects={Comment: Comment.objects.exclude(pk=comment_2.pk)})
+        db_queries.clear()
+        assert flags[Comment][0].linked_object is None
+        assert len(db_queries) == 0  # Not re-fetched bypassing the queryset.
+
+    def test_iter_flags_for_types(self, user, user_create, create_comment, create_article, db_queries):
+        from siteflags.tests.testapp.models import Comment, Article
+
+        user2 = user_create()
+
+        articles = [create_article() for _ in range(5)]
+        comments = [create_comment() for _ in range(2)]
+
+        for obj in articles + comments:
+            obj.set_flag(user)
+            obj.set_flag(user2, status=2)
+
+        batches = list(ModelWithFlag.iter_flags_for_types([Article, Comment], user=user, batch_size=3))
+        assert len(batches) == 3
+        assert [len(batch.get(Article, [])) + len(batch.get(Comment, [])) for batch in batches] == [3, 3, 1]
+
+        flags = [flag for batch in batches for flags in batch.values() for flag in flags]
+        assert len({flag.id for flag in flags}) == 7
+        assert [flag.get_cursor() for flag in flags] == sorted((flag.get_cursor() for flag in flags), reverse=True)
+
+        # Continue from a cursor: flags older than the flag of the 5th article by the first user.
+        assert flags[2].object_id == articles[4].pk
+        batches = list(Article.iter_flags_for_types(batch_size=10, after=flags[2].get_cursor()))
+        assert len(batches) == 1
+        assert len(batches[0][Article]) == 8
+
+        batches = list(Article.iter_flags_for_types(status=2, with_objects=True, batch_size=2))
+        assert len(batches) == 3
+
+        db_queries.clear()
+        titles = {flag.linked_object.title for batch in batches for flag in batch[Article]}
+        assert len(titles) == 5
+        assert len(db_queries) == 0
+
+        assert not list(Article.iter_flags_for_types(user=user_create(anonymous=True)))
+
+    def test_get_flags_for_objects(
+            self, user, user_create, create_article, create_comment, monkeypatch, db_queries):
+        from django.core.cache import cache
+        from siteflags import settings
+        from siteflags.tests.testapp.models import Article, Comment
+
         user2 = user_create()
 
         article_1 = create_article()
@@ -99,6 +191,102 @@ class TestModelWithFlag:
         assert len(flags[article_2.pk]) == 1
         assert len(flags[article_3.pk]) == 0
 
+        # Objects of different types.
+        comment = create_comment()
+        comment.set_flag(user, status=33)
+        objects_list = [comment, article_1, article_2]
+
+        cache.clear()
+
+        for caching, queries_expected in ((False, 1), (True, 1), (True, 0)):
+
+            if caching:
+                monkeypatch.setattr(settings, 'CACHE', 'default')
+
+            db_queries.clear()
+            flags = ModelWithFlag.get_flags_for_objects(objects_list, status=33, key_by_model=True)
+            assert len([sql for sql in db_queries.sql() if 'siteflags_flag' in sql]) == queries_expected
+            assert {key: len(value) for key, value in flags.items()} == {
+                (Comment, comment.pk): 1,
+                (Article, article_1.pk): 0,
+                (Article, article_2.pk): 1,
+            }
+
+        monkeypatch.setattr(settings, 'CACHE', None)
+
+        # Queryset is evaluated once.
+        db_queries.clear()
+        flags = Article.get_flags_for_objects(Article.objects.filter(pk__in=[article_1.pk, article_3.pk]))
+        assert len(flags[article_1.pk]) == 2
+        assert len(db_queries) == 2
+
+    def test_lightweight(self, user, create_article, create_comment, monkeypatch, db_queries):
+        from django.core.cache import cache
+        from siteflags import settings
+        from siteflags.models import FlagRecord
+        from siteflags.tests.testapp.models import Article, Comment
+
+        article = create_article()
+        article.set_flag(user, note='some', status=1)
+        create_comment().set_flag(user)
+
+        for caching in (False, True):
+
+            if caching:
+                monkeypatch.setattr(settings, 'CACHE', 'default')
+                cache.clear()
+                Article.get_flags_for_objects([article])  # Full objects are cached separately.
+
+            db_queries.clear()
+            flags = Article.get_flags_for_objects([article], user=user, lightweight=True)[article.pk]
+            assert len(flags) == 1
+            flag = flags[0]
+            assert isinstance(flag, FlagRecord)
+            assert (flag.object_id, flag.user_id, flag.status) == (article.pk, user.id, 1)
+            assert 'note' not in db_queries.sql()[-1]
+
+            flags = Article.get_flags_for_types([Article, Comment], lightweight=True)
+            assert isinstance(flags[Article][0], FlagRecord)
+            assert flags[Comment][0].status is None
+            assert isinstance(Comment.get_flags_for_type(lightweight=True)[0], FlagRecord)
+
+        with pytest.raises(ValueError):
+            Article.get_flags_for_types([Article], with_objects=True, lightweight=True)
+
+    def test_queryset(self, user, user_create, create_article, enable_counters, db_queries):
+        from siteflags.tests.testapp.models import Article
+
+        user2 = user_create()
+        article_1 = create_article()
+        article_2 = create_article()
+        article_3 = create_article()
+
+        article_1.set_flag(user, status=1)
+        article_2.set_flag(user, status=1)
+        article_2.set_flag(user2, status=1)
+        article_2.set_flag(user2, status=2)
+
+        db_queries.clear()
+        articles = list(Article.objects.with_flag_count().order_by('-flag_count', 'id'))
+        assert [(article.pk, article.flag_count) for article in articles] == [
+            (article_2.pk, 3), (article_1.pk, 1), (article_3.pk, 0)]
+        assert len(db_queries) == 1
+
+        articles = Article.objects.with_flag_count(status=1, user=user2, name='likes').order_by('id')
+        assert [article.likes for article in articles] == [0, 1, 0]
+
+        articles = Article.objects.with_user_flag(user2, status=2).order_by('id')
+        assert [article.user_flagged for article in articles] == [False, True, False]
+
+        assert list(Article.objects.flagged_by(user).order_by('id')) == [article_1, article_2]
+        assert list(Article.objects.flagged_by(user2, status=[2, 3])) == [article_2]
+        assert list(Article.objects.not_flagged_by(user2).order_by('id')) == [article_1, article_3]
+        assert list(Article.objects.flagged_by(user_create(anonymous=True))) == []
+
+        enable_counters()
+        articles = Article.objects.with_flag_count(status=[1, 2]).order_by('id')
+        assert [article.flag_count for article in articles] == [1, 3, 0]
+
     def test_set_flag(self, user, create_article):
 
         flag = create_article().set_flag(user, note='anote', status=10)
@@ -107,6 +295,97 @@ class TestModelWithFlag:
         assert flag.note == 'anote'
         assert flag.status == 10
 
+    def test_set_flag_if_exists(self, user, create_article, enable_counters, db_queries):
+
+        article = create_article()
+        article.set_flag(user, note='anote', status=10)
+
+        assert article.set_flag(user, note='other', status=10) is None
+
+        db_queries.clear()
+        flag = article.set_flag(user, note='other', status=10, if_exists='ignore')
+        assert flag.pk
+        assert flag.note == 'anote'
+        assert not [sql for sql in db_queries.sql() if 'SAVEPOINT' in sql]
+        assert article.get_flags(user)[0].note == 'anote'
+
+        flag = article.set_flag(user, note='other', status=10, if_exists='update_note')
+        assert (flag.pk, flag.note) == (article.get_flags(user)[0].pk, 'other')
+        article.set_flag(user, note='new', status=11, if_exists='update_note')
+        assert {flag.status: flag.note for flag in article.get_flags(user)} == {10: 'other', 11: 'new'}
+
+        with pytest.raises(ValueError):
+            article.set_flag(user, if_exists='bogus')
+
+        enable_counters()
+        article.set_flag(user, status=10, if_exists='ignore')
+        article.set_flag(user, status=12, if_exists='ignore')
+        assert article.is_flagged(status=10) == 1
+        assert article.is_flagged(status=12) == 1
+
+    def test_no_status_uniqueness(self, user, create_article, command_run, enable_counters, capsys):
+        from django.db import connection
+        from siteflags.models import Flag
+
+        article = create_article()
+
+        assert article.set_flag(user)
+        assert article.set_flag(user) is None
+        assert article.set_flag(user, if_exists='ignore')
+        assert article.is_flagged(user) == 1
+
+        # Duplicates created before uniqueness was enforced.
+        constraint = Flag._meta.constraints[0]
+
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(Flag, constraint)
+
+        try:
+            Flag.objects.bulk_create([
+                Flag(content_type_id=flag.content_type_id, object_id=flag.object_id, user=user)
+                for flag in [article.get_flags()[0]] * 2])
+            article.set_flag(user, status=1)
+            assert article.is_flagged(user) == 4
+
+            enable_counters()
+
+            command_run('siteflags_remove_duplicates')
+            assert capsys.readouterr().out == 'Duplicates removed: 2\n'
+            assert article.is_flagged(user) == 2
+            assert article.is_flagged() == 2  # Counters are updated.
+            assert Flag.remove_duplicates() == 0
+
+        finally:
+            with connection.schema_editor() as editor:
+                editor.add_constraint(Flag, constraint)
+
+    def test_toggle_flag(self, user, user_create, create_article, enable_counters):
+
+        article = create_article()
+        user2 = user_create()
+        article.set_flag(user2, status=1)
+
+        assert article.toggle_flag(user, status=1, note='anote') is True
+        assert article.is_flagged(user, status=1) == 1
+        assert article.get_flags(user)[0].note == 'anote'
+        assert article.toggle_flag(user, status=1) is False
+        assert article.is_flagged(user, status=1) == 0
+        assert article.is_flagged(user2, status=1) == 1
+
+        # No status matches flags without status only.
+        article.set_flag(user, status=2)
+        assert article.toggle_flag(user) is True
+        assert article.toggle_flag(user) is False
+        assert article.is_flagged(user, status=2) == 1
+
+        assert article.toggle_flag(user_create(anonymous=True)) is False
+
+        enable_counters()
+        assert article.toggle_flag(user, status=1) is True
+        assert article.is_flagged(status=1) == 2
+        assert article.toggle_flag(user, status=1) is False
+        assert article.is_flagged(status=1) == 1
+
     def test_get_flags(self, user, user_create, create_article):
         article = create_article()
 
@@ -141,6 +420,95 @@ class TestModelWithFlag:
         assert not article.is_flagged(user3, status=12)
         assert not article.is_flagged(user3, status=11)
 
+    def test_get_flag_statuses(self, user, user_create, create_article, enable_counters, db_queries):
+        from siteflags.tests.testapp.models import Article
+
+        user2 = user_create()
+        article_1 = create_article()
+        article_2 = create_article()
+        articles = [article_1, article_2]
+
+        article_1.set_flag(user, status=1)
+        article_1.set_flag(user, status=2)
+        article_1.set_flag(user)
+        article_1.set_flag(user2, status=1)
+
+        db_queries.clear()
+        assert article_1.get_flag_statuses() == {1: 2, 2: 1, None: 1}
+        assert len(db_queries) == 1
+
+        assert article_1.get_flag_statuses(user) == {1: 1, 2: 1, None: 1}
+        assert article_1.get_flag_statuses(user2, status=[1, 2]) == {1: 1}
+        assert article_1.get_flag_statuses(user2, status=2) == {}
+        assert article_2.get_flag_statuses() == {}
+        assert article_1.get_flag_statuses(user_create(anonymous=True)) == {}
+
+        assert Article.get_flag_statuses_for_objects(articles, status=[1, 2]) == {
+            article_1.pk: {1: 2, 2: 1},
+            article_2.pk: {},
+        }
+
+        # From prefetched.
+        Article.prefetch_flags(articles, user=user)
+        db_queries.clear()
+        assert article_1.get_flag_statuses(user, status=[1, 3]) == {1: 1}
+        assert article_2.get_flag_statuses(user) == {}
+        assert len(db_queries) == 0
+
+        # From counters.
+        enable_counters()
+
+        assert Article.get_flag_statuses_for_objects(articles) == {
+            article_1.pk: {1: 2, 2: 1, None: 1},
+            article_2.pk: {},
+        }
+
+    def test_get_top_flagged(self, user_create, create_article, create_comment, monkeypatch, enable_counters):
+        from datetime import timedelta
+        from django.core.cache import cache
+        from django.utils.timezone import now
+        from siteflags import settings
+        from siteflags.models import Flag, FlagCounter
+        from siteflags.tests.testapp.models import Article
+
+        users = [user_create() for _ in range(3)]
+        article_1, article_2, article_3 = articles = [create_article() for _ in range(3)]
+        create_comment().set_flag(users[0], status=1)
+
+        for user in users:
+            article_2.set_flag(user, status=1)
+
+        for user in users[:2]:
+            article_1.set_flag(user, status=1)
+
+        article_3.set_flag(users[0], status=2)
+
+        expected = [(article_2.pk, 3), (article_1.pk, 2), (article_3.pk, 1)]
+
+        assert Article.get_top_flagged() == expected
+        assert Article.get_top_flagged(limit=2) == expected[:2]
+        assert Article.get_top_flagged(status=1) == expected[:2]
+        assert Article.get_top_flagged(status=1, with_objects=True) == [(article_2, 3), (article_1, 2)]
+
+        Flag.objects.filter(object_id=article_2.pk).update(time_created=now() - timedelta(days=10))
+        assert Article.get_top_flagged(since=now() - timedelta(days=1)) == [(article_1.pk, 2), (article_3.pk, 1)]
+
+        # Counters.
+        enable_counters()
+        assert Article.get_top_flagged() == expected
+        article_3.remove_flag()
+        assert Article.get_top_flagged() == expected[:2]
+
+        # Cache.
+        monkeypatch.setattr(settings, 'CACHE', 'default')
+        cache.clear()
+        assert Article.get_top_flagged() == expected[:2]
+        FlagCounter.objects.all().delete()
+        assert Article.get_top_flagged() == expected[:2]  # Cached.
+        assert Article.get_top_flagged(since=now() - timedelta(days=1)) == [(article_1.pk, 2)]  # Not cached.
+        Article.set_flags_for_objects(articles, user=users[0], status=3)
+        assert Article.get_top_flagged() == [(article_1.pk, 1), (article_2.pk, 1), (article_3.pk, 1)]
+
     def test_remove_flag(self, user, user_create, create_article):
         article = create_article()
         article.set_flag(user, status=11)
@@ -172,3 +540,910 @@ class TestModelWithFlag:
         article.remove_flag()
         flags = article.get_flags()
         assert len(flags) == 0
+
+    def test_set_flags_for_objects(self, user, user_create, create_article, create_comment, db_queries):
+        article_1 = create_article()
+        article_2 = create_article()
+        comment = create_comment()
+
+        article_1.set_flag(user, status=5)
+
+        db_queries.clear()
+        created = ModelWithFlag.set_flags_for_objects([article_1, article_2, comment], user=user, status=5, note='bulk')
+        assert created == 2
+        flag_queries = [sql for sql in db_queries.sql() if 'siteflags_flag' in sql]
+        assert len(flag_queries) == 3  # A lookup per type and a single insert.
+
+        assert article_1.is_flagged(user, status=5) == 1
+        assert article_2.get_flags(user, status=5)[0].note == 'bulk'
+        assert comment.is_flagged(user, status=5) == 1
+
+        # Already flagged objects are skipped.
+        assert ModelWithFlag.set_flags_for_objects([article_1, article_2], user=user, status=5) == 0
+
+        # Unset status is respected too.
+        assert ModelWithFlag.set_flags_for_objects([article_1, article_1], user=user) == 1
+        assert ModelWithFlag.set_flags_for_objects([article_1], user=user) == 0
+        assert article_1.is_flagged(user) == 2
+
+        assert ModelWithFlag.set_flags_for_objects([article_1], user=user_create(anonymous=True)) == 0
+        assert ModelWithFlag.set_flags_for_objects([], user=user) == 0
+
+    def test_remove_flags_for_objects(self, user, user_create, create_article, create_comment):
+        user2 = user_create()
+
+        article_1 = create_article()
+        article_2 = create_article()
+        comment = create_comment()
+        objects = [article_1, article_2, comment]
+
+        ModelWithFlag.set_flags_for_objects(objects, user=user, status=1)
+        ModelWithFlag.set_flags_for_objects(objects, user=user, status=2)
+        ModelWithFlag.set_flags_for_objects(objects, user=user2, status=1)
+
+        assert ModelWithFlag.remove_flags_for_objects([article_1, comment], user=user, status=1) == 2
+        assert article_1.is_flagged(user) == 1
+        assert article_2.is_flagged(user) == 2
+
+        assert ModelWithFlag.remove_flags_for_objects(objects, status=1) == 4
+        assert ModelWithFlag.remove_flags_for_objects(objects) == 3
+
+        for obj in objects:
+            assert not obj.is_flagged()
+
+    def test_prefetch_flags(self, user, user_create, create_article, db_queries):
+        from siteflags.tests.testapp.models import Article
+
+        user2 = user_create()
+
+        article_1 = create_article()
+        article_2 = create_article()
+        article_1.set_flag(user, status=1)
+        article_1.set_flag(user, status=2)
+        article_1.set_flag(user2, status=1)
+
+        articles = Article.prefetch_flags(Article.objects.filter(pk__in=[article_1.pk, article_2.pk]).order_by('pk'))
+
+        db_queries.clear()
+        article_1, article_2 = articles
+
+        assert article_1.is_flagged() == 3
+        assert article_1.is_flagged(user) == 2
+        assert article_1.is_flagged(user2, status=1) == 1
+        assert len(article_1.get_flags(status=1)) == 2
+        assert not article_2.is_flagged(user)
+        assert not article_2.get_flags()
+        assert len(db_queries) == 0
+
+        # Prefetched for a certain user and statuses.
+        article_1, article_2 = Article.prefetch_flags(articles, user=user, status=[1, 3])
+        db_queries.clear()
+
+        assert article_1.is_flagged(user, status=1) == 1
+        assert not article_1.is_flagged(user, status=3)
+        assert len(db_queries) == 0
+
+        # Not prefetched data is fetched from DB.
+        assert article_1.is_flagged(user, status=2) == 1
+        assert article_1.is_flagged(user2, status=1) == 1
+        assert len(article_1.get_flags(user)) == 2
+        assert len(db_queries) == 3
+
+        # Modification drops prefetched data.
+        article_2.set_flag(user, status=1)
+        assert article_2.is_flagged(user, status=1) == 1
+
+        article_1.remove_flag(user, status=1)
+        assert not article_1.is_flagged(user, status=1)
+
+    def test_cache(self, user, user_create, create_article, create_comment, monkeypatch, count_flag_queries):
+        from django.core.cache import cache, caches
+        from siteflags import settings
+        from siteflags.cache import FlagsCache
+        from siteflags.tests.testapp.models import Article, Comment
+
+        monkeypatch.setattr(settings, 'CACHE', 'default')
+        cache.clear()
+
+        user2 = user_create()
+        article_1 = create_article()
+        article_2 = create_article()
+        article_1.set_flag(user, status=1)
+
+        # Object level.
+        assert count_flag_queries(lambda: article_1.is_flagged(user)) == (1, 1)
+        assert count_flag_queries(lambda: article_1.is_flagged(user)) == (1, 0)
+        assert count_flag_queries(lambda: len(article_1.get_flags(status=1))) == (1, 1)
+        assert count_flag_queries(lambda: len(article_1.get_flags(status=1))) == (1, 0)
+
+        # Cached flags are returned as a list.
+        flags, queries = count_flag_queries(lambda: article_1.get_flags(status=1))
+        assert isinstance(flags, list)
+        assert (len(flags), queries) == (1, 0)
+        assert count_flag_queries(lambda: article_2.is_flagged(user)) == (0, 1)
+        assert count_flag_queries(lambda: article_2.is_flagged(user)) == (0, 0)
+
+        flags, queries = count_flag_queries(lambda: Article.get_flags_for_objects([article_1, article_2], status=1))
+        assert (len(flags[article_1.pk]), len(flags[article_2.pk]), queries) == (1, 0, 1)
+
+        flags, queries = count_flag_queries(lambda: Article.get_flags_for_objects([article_1, article_2], status=1))
+        assert (len(flags[article_1.pk]), len(flags[article_2.pk]), queries) == (1, 0, 0)
+
+        # Versions of many objects are set at once.
+        cache_calls = []
+        monkeypatch.setattr(caches['default'], 'add', lambda *args, **kwargs: cache_calls.append('add'))
+        monkeypatch.setattr(caches['default'], 'set_many', lambda *args, **kwargs: cache_calls.append('set_many'))
+        FlagsCache(caches['default'], timeout=60).get_objects_keys('flags', 1, range(500), user_id=None, status=None)
+        assert cache_calls == ['set_many']
+        monkeypatch.undo()
+        monkeypatch.setattr(settings, 'CACHE', 'default')
+
+        # Types level.
+        flags, queries = count_flag_queries(lambda: Article.get_flags_for_types([Article, Comment], user=user))
+        assert (len(flags[Article]), queries) == (1, 1)
+
+        flags, queries = count_flag_queries(lambda: Article.get_flags_for_types([Article, Comment], user=user))
+        assert (len(flags[Article]), queries) == (1, 0)
+
+        flags, queries = count_flag_queries(lambda: Article.get_flags_for_types([Article, Comment]))
+        assert (len(flags[Article]), queries) == (1, 1)
+
+        # Modifications invalidate cached entries.
+        article_2.set_flag(user, status=1)
+        assert article_2.is_flagged(user) == 1
+        assert len(Article.get_flags_for_objects([article_1, article_2], status=1)[article_2.pk]) == 1
+        assert len(Article.get_flags_for_types([Article, Comment], user=user)[Article]) == 2
+        assert len(Article.get_flags_for_types([Article, Comment])[Article]) == 2
+
+        # Another user's modification doesn't affect other users types entries.
+        create_comment().set_flag(user2)
+        assert count_flag_queries(
+            lambda: len(Article.get_flags_for_types([Article, Comment], user=user)[Article])) == (2, 0)
+
+        Article.remove_flags_for_objects([article_1, article_2])
+        assert not article_1.is_flagged(user)
+        assert not article_2.get_flags(status=1)
+        assert not Article.get_flags_for_types([Article, Comment], user=user)[Article]
+
+        Article.set_flags_for_objects([article_1], user=user)
+        assert article_1.is_flagged(user) == 1
+
+        article_1.remove_flag()
+        assert not article_1.is_flagged()
+        assert not Article.get_flags_for_types([Article, Comment], user=user)[Article]
+
+    def test_filter_flagged_ids(self, user, user_create, create_article, monkeypatch, count_flag_queries):
+        import pickle
+        from django.core.cache import cache
+        from siteflags import settings
+        from siteflags.cache import ObjectsIds
+        from siteflags.tests.testapp.models import Article
+
+        ids = ObjectsIds([10, 3, 7, 3])
+        assert len(ids) == 3
+        assert 7 in ids and 8 not in ids and 11 not in ids
+        assert pickle.loads(pickle.dumps(ids)).filter([11, 10, 1, 3]) == [10, 3]
+
+        user2 = user_create()
+        articles = [create_article() for _ in range(4)]
+        ids = [article.pk for article in articles]
+        articles[2].set_flag(user, status=1)
+        articles[0].set_flag(user, status=2)
+        articles[1].set_flag(user2, status=1)
+
+        assert Article.filter_flagged_ids(ids, user=user) == [ids[0], ids[2]]
+        assert Article.filter_flagged_ids(ids, user=user, status=1) == [ids[2]]
+        assert Article.filter_flagged_ids([], user=user) == []
+        assert Article.filter_flagged_ids(ids, user=user_create(anonymous=True)) == []
+
+        monkeypatch.setattr(settings, 'CACHE', 'default')
+        cache.clear()
+
+        assert count_flag_queries(lambda: Article.filter_flagged_ids(ids, user=user)) == ([ids[0], ids[2]], 1)
+        assert count_flag_queries(lambda: Article.filter_flagged_ids(ids[::-1], user=user)) == ([ids[2], ids[0]], 0)
+        assert count_flag_queries(lambda: Article.filter_flagged_ids(ids, user=user, status=[1])) == ([ids[2]], 1)
+
+        # Modifications invalidate cached sets.
+        articles[3].set_flag(user, status=1)
+        assert Article.filter_flagged_ids(ids, user=user) == [ids[0], ids[2], ids[3]]
+        assert Article.filter_flagged_ids(ids, user=user2) == [ids[1]]
+
+        articles[0].remove_flag()
+        assert Article.filter_flagged_ids(ids, user=user) == [ids[2], ids[3]]
+
+    def test_counters(self, user, user_create, create_article, monkeypatch, command_run):
+        from siteflags import settings
+        from siteflags.models import FlagCounter
+        from siteflags.tests.testapp.models import Article
+
+        monkeypatch.setattr(settings, 'COUNTERS', True)
+
+        user2 = user_create()
+        article_1 = create_article()
+        article_2 = create_article()
+        articles = [article_1, article_2]
+
+        article_1.set_flag(user, status=1)
+        article_1.set_flag(user, status=1)  # Already exists.
+        article_1.set_flag(user2, status=1)
+        article_1.set_flag(user)
+        article_1.set_flag(user2)
+        Article.set_flags_for_objects(articles, user=user, status=2)
+
+        assert Article.get_flag_counts_for_objects(articles) == {article_1.pk: 5, article_2.pk: 1}
+        assert Article.get_flag_counts_for_objects(articles, status=1) == {article_1.pk: 2, article_2.pk: 0}
+        assert article_1.is_flagged() == 5
+        assert article_1.is_flagged(status=2) == 1
+        assert FlagCounter.objects.count() == 4
+
+        article_1.remove_flag(user)
+        assert Article.get_flag_counts_for_objects(articles) == {article_1.pk: 2, article_2.pk: 1}
+
+        Article.remove_flags_for_objects(articles, status=2)
+        assert Article.get_flag_counts_for_objects(articles) == {article_1.pk: 2, article_2.pk: 0}
+
+        # Deletion of objects and users.
+        article_3 = create_article()
+        user3 = user_create()
+        article_3.set_flag(user3, status=1)
+        article_1.set_flag(user3, status=1)
+        assert article_1.is_flagged(status=1) == 2
+
+        article_3.delete()
+        assert Article.get_top_flagged() == [(article_1.pk, 3)]
+
+        user3.delete()
+        assert article_1.is_flagged(status=1) == 1
+        assert Article.get_top_flagged() == [(article_1.pk, 2)]
+
+        # Rebuild.
+        FlagCounter.objects.all().delete()
+        assert not article_1.is_flagged()
+        command_run('siteflags_rebuild_counters')
+        assert article_1.is_flagged() == 2
+        assert article_1.is_flagged(status=1) == 1
+        assert FlagCounter.objects.count() == 2
+
+        # Counting without counters.
+        monkeypatch.setattr(settings, 'COUNTERS', False)
+        assert Article.get_flag_counts_for_objects(articles) == {article_1.pk: 2, article_2.pk: 0}
+        assert Article.get_flag_counts_for_objects([]) == {}
+
+    def test_get_user_flags(self, user, user_create, create_article, create_comment, db_queries):
+        from siteflags.tests.testapp.models import Article
+
+        user2 = user_create()
+        flag_model = get_flag_model()
+
+        article_1 = create_article()
+        comment = create_comment()
+        article_2 = create_article()
+
+        article_1.set_flag(user, status=1)
+        comment.set_flag(user, status=1)
+        comment.set_flag(user2, status=1)
+        article_2.set_flag(user, status=2)
+        article_2.set_flag(user, status=1)
+
+        db_queries.clear()
+        flags = flag_model.get_user_flags(user, status=1, limit=2)
+        assert [flag.linked_object for flag in flags] == [article_2, comment]
+        assert len(db_queries) == 3  # Flags and objects of two types.
+
+        flags = flag_model.get_user_flags(user, status=1, limit=2, after=flags[-1].get_cursor())
+        assert [flag.linked_object for flag in flags] == [article_1]
+
+        flags = flag_model.get_user_flags(
+            user, status=[1, 2], with_objects={Article: Article.objects.only('id')})
+        assert [flag.status for flag in flags] == [1, 2, 1, 1]
+        assert flags[0].linked_object.get_deferred_fields() == {'title'}
+
+        assert len(flag_model.get_user_flags(user2, with_objects=False)) == 1
+        assert flag_model.get_user_flags(user_create(anonymous=True)) == []
+
+    def test_purge_expired(self, user, user_create, create_article, monkeypatch, command_run, capsys, enable_counters):
+        from datetime import timedelta
+        from django.utils.timezone import now
+        from siteflags import settings
+        from siteflags.models import Flag, FlagArchive
+
+        user2 = user_create()
+        article_1 = create_article()
+        article_2 = create_article()
+
+        for article in (article_1, article_2):
+            article.set_flag(user, status=1, note='one')
+            article.set_flag(user2, status=1)
+            article.set_flag(user)
+            article.set_flag(user, status=2)
+
+        days_ago = now() - timedelta(days=10)
+        Flag.objects.exclude(object_id=article_2.pk, user=user2).update(time_created=days_ago)
+
+        enable_counters()
+
+        # Nothing is configured.
+        assert Flag.purge_expired() == 0
+
+        monkeypatch.setattr(settings, 'RETENTION', {1: timedelta(days=5), None: 3600 * 24 * 20})
+        totals = []
+        assert Flag.purge_expired(chunk_size=2, progress=totals.append) == 3
+        assert totals == [2, 3]
+        assert Flag.objects.filter(status=1).count() == 1
+        assert article_1.is_flagged(status=1) == 0
+        assert article_2.is_flagged(status=1) == 1
+        assert not FlagArchive.objects.exists()
+
+        # Archiving.
+        monkeypatch.setattr(settings, 'ARCHIVE', True)
+        monkeypatch.setattr(settings, 'RETENTION', {None: timedelta(days=5)})
+        command_run('siteflags_purge_expired')
+        assert capsys.readouterr().out == 'Expired flags removed: 2\n'
+
+        archived = list(FlagArchive.objects.order_by('object_id'))
+        assert [(flag.object_id, flag.user_id, flag.status) for flag in archived] == [
+            (article_1.pk, user.id, None), (article_2.pk, user.id, None)]
+        assert archived[0].time_created == days_ago
+        assert article_1.is_flagged() == 1
+
+    def test_remove_orphans(
+            self, user, user_create, create_article, create_comment, enable_counters, command_run, capsys, db_queries):
+        from django.contrib.contenttypes.models import ContentType
+        from siteflags.models import Flag
+        from siteflags.tests.testapp.models import Article
+        from siteflags.utils import get_content_type_id
+
+        user2 = user_create()
+        article_1 = create_article()
+        article_2 = create_article()
+        article_3 = create_article()
+        comment = create_comment()
+
+        for obj in (article_1, article_2, article_3, comment):
+            obj.set_flag(user, status=1)
+            obj.set_flag(user2)
+
+        enable_counters()
+
+        # Orphans of a deleted article and of a comment never existed.
+        Flag.objects.create(content_type_id=get_content_type_id(Article), object_id=9999, user=user)
+        Flag.objects.create(content_type_id=get_content_type_id(comment), object_id=9999, user=user, status=1)
+        Flag.objects.create(content_type_id=get_content_type_id(comment), object_id=9998, user=user, status=2)
+
+        assert Flag.objects.count() == 11
+
+        totals = []
+        assert Flag.remove_orphans(chunk_size=1, progress=totals.append) == 3
+        assert totals == [1, 2, 3]
+        assert Flag.objects.count() == 8
+        assert Flag.remove_orphans() == 0
+
+        Flag.objects.create(content_type_id=get_content_type_id(Article), object_id=9999, user=user)
+        command_run('siteflags_remove_orphans')
+        assert capsys.readouterr().out == 'Orphaned flags removed: 1\n'
+
+        # Stale content types are only processed on demand.
+        stale = ContentType.objects.create(app_label='gone', model='gone')
+        Flag.objects.create(content_type=stale, object_id=article_3.pk, user=user)
+        assert Flag.remove_orphans() == 0
+        command_run('siteflags_remove_orphans', args=['--include-stale-types'])
+        assert capsys.readouterr().out == 'Orphaned flags removed: 1\n'
+
+        # Deletion of objects along with flags. Number of queries doesn't depend on number of objects.
+        db_queries.clear()
+        deleted, counts = Article.objects.filter(pk__in=[article_1.pk, article_2.pk]).delete_with_flags()
+        assert len([sql for sql in db_queries.sql() if 'SAVEPOINT' not in sql]) == 7
+        assert deleted == 6
+        assert counts['siteflags.Flag'] == 4
+        assert counts['testapp.Article'] == 2
+
+        assert Flag.objects.count() == 4
+        assert article_3.is_flagged() == 2
+        assert Article.get_flag_counts_for_objects([article_1, article_3]) == {article_1.pk: 0, article_3.pk: 2}
+        assert Flag.remove_orphans() == 0
+
+    def test_queries_use_indexes(self, user, create_article, create_comment, db_queries):
+        from django.db import connection
+        from django.utils.timezone import now
+        from siteflags.tests.testapp.models import Article, Comment
+
+        article = create_article()
+        comment = create_comment()
+        article.set_flag(user, status=1)
+        comment.set_flag(user)
+
+        db_queries.clear()
+
+        Article.get_flags_for_types([Article, Comment], user=user, status=1)
+        Article.get_flags_for_types([Article, Comment], status=1)
+        Article.get_flags_for_types([Article, Comment])
+        list(Article.iter_flags_for_types([Article, Comment], user=user, status=1, after=(now(), 1)))
+        Article.get_flags_for_objects([article], user=user, status=1)
+        Article.get_flags_for_objects([article])
+        get_flag_model().get_user_flags(user, status=1, after=(now(), 1), with_objects=False)
+        Article.get_flag_counts_for_objects([article], status=1)
+        Article.set_flags_for_objects([article, comment], user=user, status=2)
+        Article.remove_flags_for_objects([article, comment], user=user, status=2)
+        list(article.get_flags(user, status=1))
+        article.is_flagged(user, status=1)
+        article.is_flagged()
+        article.remove_flag(user, status=3)
+        article.remove_flag(status=3)
+
+        queries = [
+            sql for sql in db_queries.sql()
+            if 'siteflags_flag' in sql and sql.startswith(('SELECT', 'DELETE'))]
+        assert len(queries) == 17
+
+        vendor = connection.vendor
+
+        with connection.cursor() as cursor:
+
+            if vendor == 'postgresql':
+                # Small tables are scanned sequentially anyway.
+                cursor.execute('SET enable_seqscan = off')
+
+            for sql in queries:
+
+                if vendor == 'sqlite':
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                    plan = '\n'.join(row[-1] for row in cursor.fetchall())
+                    # Full scans of covering indexes are also not allowed.
+                    assert not re.search(r'^\s*SCAN siteflags_flag\b', plan, re.M), f'{sql}\n{plan}'
+
+                elif vendor == 'postgresql':  # pragma: nocover
+                    cursor.execute(f'EXPLAIN {sql}')
+                    plan = '\n'.join(row[0] for row in cursor.fetchall())
+                    assert 'Seq Scan on siteflags_flag' not in plan, f'{sql}\n{plan}'
+
+    def test_async(self, user, user_create, create_article, create_comment, monkeypatch):
+        from asgiref.sync import async_to_sync
+        from siteflags import settings
+        from siteflags.tests.testapp.models import Article, Comment
+
+        user2 = user_create()
+        article_1 = create_article()
+        article_2 = create_article()
+        comment = create_comment()
+
+        @async_to_sync
+        async def run():
+            assert await article_1.aset_flag(user, status=1)
+            assert await article_1.aset_flag(user, status=1) is None  # Already exists.
+            assert await article_1.aset_flag(user_create(anonymous=True)) is None
+            assert await article_1.aset_flag(user2, note='some')
+            assert await comment.aset_flag(user)
+
+            assert await article_1.ais_flagged() == 2
+            assert await article_1.ais_flagged(user, status=1) == 1
+            assert await article_1.ais_flagged(user_create(anonymous=True)) is False
+            assert await article_2.ais_flagged() == 0
+
+            flags = await article_1.aget_flags(user2)
+            assert len(flags) == 1
+            assert flags[0].note == 'some'
+
+            flags = await Article.aget_flags_for_objects(Article.objects.order_by('id'), user=user)
+            assert len(flags[article_1.pk]) == 1
+            assert flags[article_2.pk] == []
+
+            flags = await Article.aget_flags_for_types([Article, Comment], status=1)
+            assert len(flags[Article]) == 1
+            assert flags[Comment] == []
+            assert len(await Comment.aget_flags_for_type()) == 1
+
+            await article_1.aremove_flag(user, status=1)
+            assert await article_1.ais_flagged() == 1
+
+            # Falling back to synchronous API.
+            monkeypatch.setattr(settings, 'COUNTERS', True)
+            assert await article_2.aset_flag(user)
+            assert await article_2.ais_flagged() == 1
+            await article_2.aremove_flag()
+            assert await article_2.ais_flagged() == 0
+
+        run()
+
+
+def test_content_types(user, create_article, db_queries):
+    from django.contrib.contenttypes.models import ContentType
+    from siteflags.tests.testapp.models import Article, Comment
+    from django.core.signals import request_started
+    from siteflags.utils import (
+        warm_content_types_on_request, clear_content_types, get_content_type_id, WARM_DISPATCH_UID, _CONTENT_TYPES,
+    )
+
+    article = create_article()
+
+    clear_content_types()
+
+    # Warmed on the first request.
+    request_started.connect(warm_content_types_on_request, dispatch_uid=WARM_DISPATCH_UID)
+    request_started.send(sender=None)
+    assert not request_started.disconnect(dispatch_uid=WARM_DISPATCH_UID)
+    assert set(_CONTENT_TYPES['default']) == {Article, Comment}
+
+    ContentType.objects.clear_cache()
+
+    db_queries.clear()
+
+    article.set_flag(user)
+    article.is_flagged(user)
+    list(article.get_flags())
+    ModelWithFlag.get_flags_for_types([Article, Comment])
+    ModelWithFlag.get_flags_for_objects([article])
+    ModelWithFlag.set_flags_for_objects([article], user=user, status=1)
+    ModelWithFlag.remove_flags_for_objects([article], user=user, status=1)
+    article.remove_flag(user)
+
+    assert db_queries.sql()
+    assert not [sql for sql in db_queries.sql() if 'django_content_type' in sql]
+
+    assert get_content_type_id(Article) == ContentType.objects.get_for_model(Article).id
+
+
+def test_metrics(user, create_article, request_factory):
+    from siteflags.metrics import track_flags, FlagsMetricsMiddleware
+    from siteflags.signals import sig_flags_operation, sig_flags_metrics_collected
+    from siteflags.tests.testapp.models import Article
+    from siteflags.utils import get_content_type_id
+
+    article = create_article()
+    operations = []
+
+    def on_operation(sender, **kwargs):
+        operations.append(kwargs)
+
+    sig_flags_operation.connect(on_operation)
+
+    try:
+        with track_flags() as metrics:
+            article.set_flag(user, status=1)
+            assert article.get_flag_statuses(user) == {1: 1}  # Nested operation is not reported.
+            Article.get_flags_for_types([Article], user=user)
+            Article.get_flags_for_objects(Article.objects.all())
+
+        assert metrics.operations == 4
+        assert metrics.rows == 4
+        assert metrics.queries >= 4
+        assert metrics.duration > 0
+        assert set(metrics.by_operation) == {
+            'set_flag', 'get_flag_statuses', 'get_flags_for_types', 'get_flags_for_objects'}
+
+        content_type_id = get_content_type_id(Article)
+
+        assert [(item['operation'], item['content_types'], item['rows']) for item in operations] == [
+            ('set_flag', [content_type_id], 1),
+            ('get_flag_statuses', [content_type_id], 1),
+            ('get_flags_for_types', [content_type_id], 1),
+            ('get_flags_for_objects', [content_type_id], 1),
+        ]
+
+    finally:
+        sig_flags_operation.disconnect(on_operation)
+
+    # Middleware.
+    collected = []
+
+    def on_collected(sender, request, metrics, **kwargs):
+        collected.append(metrics)
+
+    sig_flags_metrics_collected.connect(on_collected)
+
+    def view(request):
+        article.is_flagged(user)
+        article.remove_flag(user)
+        return 'response'
+
+    try:
+        request = request_factory().get('/')
+        assert FlagsMetricsMiddleware(view)(request) == 'response'
+        assert request.siteflags_metrics is collected[0]
+        assert collected[0].operations == 2
+        assert collected[0].by_operation['is_flagged']['rows'] == 1
+
+    finally:
+        sig_flags_metrics_collected.disconnect(on_collected)
+
+    # Asynchronous API.
+    from asgiref.sync import async_to_sync
+
+    @async_to_sync
+    async def run():
+        with track_flags() as metrics:
+            await article.aset_flag(user, status=2)
+            await article.aget_flags(user)
+        return metrics
+
+    metrics = run()
+    assert metrics.operations == 2
+    assert metrics.rows == 2
+    assert set(metrics.by_operation) == {'aset_flag', 'aget_flags'}
+
+    # Not tracked.
+    with track_flags() as metrics:
+        pass
+
+    article.is_flagged(user)
+    assert metrics.operations == 0
+
+
+def test_buffer(user, user_create, create_article, request_factory, monkeypatch, request, db_queries, enable_counters):
+    from asgiref.sync import async_to_sync
+    from siteflags import settings
+    from siteflags.buffer import get_flags_buffer, flush_flags_buffer, FlagsBufferMiddleware
+    from siteflags.tests.testapp.models import Article
+
+    user2 = user_create()
+    article_1 = create_article()
+    article_2 = create_article()
+    article_1.set_flag(user, status=5)  # Already exists.
+
+    monkeypatch.setattr(settings, 'BUFFER_STATUSES', [5])
+    monkeypatch.setattr(settings, 'BUFFER_SIZE', 4)
+
+    buffer = get_flags_buffer()
+    request.addfinalizer(buffer.clear)
+
+    for _ in range(2):
+        flag = article_1.set_flag(user2, status=5)
+        assert flag.pk is None
+        article_1.set_flag(user, status=5)
+
+    article_2.set_flag(user, status=5, note='buffered')
+    article_2.set_flag(user, status=6)  # Not buffered.
+
+    assert len(buffer) == 3
+    assert article_1.is_flagged(status=5) == 1
+
+    enable_counters()
+
+    assert flush_flags_buffer() == 2
+    assert len(buffer) == 0
+    assert flush_flags_buffer() == 0
+    assert article_1.is_flagged(status=5) == 2  # Counters are updated.
+    assert article_2.get_flags(status=5)[0].note == 'buffered'
+
+    # Size threshold.
+    user3 = user_create()
+    for article in (article_1, article_2, create_article(), create_article()):
+        article.set_flag(user3, status=5)
+
+    assert len(buffer) == 0
+    assert article_2.is_flagged(user3) == 1
+
+    # Middleware.
+    lengths = []
+
+    def view(request):
+        article_1.set_flag(user_create(), status=5)
+        lengths.append(len(buffer))
+        return 'response'
+
+    http_request = request_factory().get('/')
+    assert FlagsBufferMiddleware(view)(http_request) == 'response'
+    assert len(buffer) == 1  # Thresholds are not reached.
+
+    monkeypatch.setattr(settings, 'BUFFER_TIMEOUT', 0)
+    assert FlagsBufferMiddleware(view)(http_request) == 'response'
+    assert lengths == [1, 2]  # Time threshold is checked by middleware, not on flag setting.
+    assert len(buffer) == 0
+    assert article_1.is_flagged(status=5) == 5
+
+    # Flushing keeps cached entries of other users.
+    monkeypatch.setattr(settings, 'CACHE', 'default')
+    monkeypatch.setattr(settings, 'BUFFER_TIMEOUT', 10)
+    Article.get_flags_for_types([Article], user=user)
+    article_2.set_flag(user_create(), status=5)
+    assert flush_flags_buffer() == 1
+
+    db_queries.clear()
+    assert len(Article.get_flags_for_types([Article], user=user)[Article]) == 3
+    assert not [sql for sql in db_queries.sql() if 'siteflags_flag' in sql]
+    monkeypatch.setattr(settings, 'CACHE', '')
+
+    # Removal of buffered flags.
+    monkeypatch.setattr(settings, 'BUFFER_TIMEOUT', 10)
+    user4 = user_create()
+
+    article_1.set_flag(user4, status=5)
+    article_1.remove_flag(user4, status=5)
+
+    article_2.set_flag(user4, status=5)
+    assert article_2.toggle_flag(user4, status=5) is False
+
+    article_1.set_flag(user4, status=5)
+    article_2.set_flag(user4, status=5)
+    article_1.remove_flag(user_create(anonymous=True))  # Other users buffered flags are intact.
+    assert len(buffer) == 2
+    assert Article.remove_flags_for_objects([article_1, article_2], user=user4) == 2
+
+    assert len(buffer) == 0
+    assert flush_flags_buffer() == 0
+    assert not Article.get_flags_for_objects([article_1, article_2], user=user4)[article_1.pk]
+
+    # Asynchronous API uses buffer as well (native path).
+    monkeypatch.setattr(settings, 'COUNTERS', False)
+
+    @async_to_sync
+    async def run():
+        assert (await article_1.aset_flag(user4, status=5)).pk is None
+        assert len(buffer) == 1
+        await article_1.aremove_flag(user4)
+        assert len(buffer) == 0
+
+    run()
+
+
+def test_admin(user, user_create, create_article, create_comment, request_factory, db_queries, monkeypatch):
+    from django.contrib.admin import site
+    from siteflags import admin
+    from siteflags.models import Flag
+
+    article = create_article()
+    comment = create_comment()
+    user.username = 'someuser'
+    user.save()
+    article.set_flag(user)
+    comment.set_flag(user)
+    comment.set_flag(user_create())
+
+    model_admin = admin.FlagModelAdmin(Flag, site)
+
+    def get_changelist(**params):
+        request = request_factory().get('/', params)
+        request.user = user_create(superuser=True)
+        db_queries.clear()
+        changelist = model_admin.get_changelist_instance(request)
+        return changelist, [model_admin.linked_object_display(flag) for flag in changelist.result_list]
+
+    changelist, objects = get_changelist()
+    assert changelist.result_count == 3
+    assert objects == [f'{comment}', f'{comment}', f'{article}']
+    # Flags (with users and content types joined) and objects of two types. No full count.
+    queries = [sql for sql in db_queries.sql() if 'siteflags_flag' in sql or 'testapp_' in sql]
+    assert len([sql for sql in queries if 'COUNT' not in sql]) == 3
+    assert len([sql for sql in queries if 'COUNT' in sql]) == 1
+
+    changelist, _ = get_changelist(q='some')
+    assert changelist.result_count == 2
+
+    changelist, _ = get_changelist(q=f'{article.pk}')
+    assert {flag.object_id for flag in changelist.result_list} == {article.pk}
+
+    user_digits = user_create()
+    user_digits.username = f'{article.pk}00'
+    user_digits.save()
+    comment.set_flag(user_digits)
+
+    changelist, _ = get_changelist(q=f'{article.pk}00')
+    assert [flag.user_id for flag in changelist.result_list] == [user_digits.id]
+
+    # Estimates are not used for filtered querysets and unsupported DBs.
+    assert admin.get_estimated_count(Flag.objects.filter(status=1)) is None
+
+    monkeypatch.setattr(admin, 'get_estimated_count', lambda queryset: 200000)
+    assert admin.EstimatedCountPaginator(Flag.objects.order_by('-id'), 10).count == 200000
+
+
+def test_transfer(
+        user, user_create, create_article, create_comment, command_run, capsys, tmp_path, enable_counters, dump_flags):
+    from datetime import timedelta
+    from django.utils.timezone import now
+    from siteflags.models import FlagCounter
+    from siteflags.transfer import export_flags, import_flags
+
+    flag_model = get_flag_model()
+    user2 = user_create()
+    article = create_article()
+    comment = create_comment()
+
+    article.set_flag(user, status=1, note='one, "quoted"')
+    article.set_flag(user2)
+    comment.set_flag(user, status=2)
+
+    days_ago = now() - timedelta(days=10)
+    flag_model.objects.update(time_created=days_ago)
+
+    flags_before = dump_flags()
+
+    for fmt in ('csv', 'jsonl'):
+        path = tmp_path / f'flags.{fmt}'
+
+        totals = []
+        with open(path, 'w', newline='') as f:
+            assert export_flags(f, fmt=fmt, chunk_size=2, progress=totals.append) == 3
+        assert totals == [2, 3]
+
+        flag_model.objects.all().delete()
+
+        with open(path, newline='') as f:
+            assert import_flags(f, fmt=fmt, chunk_size=2) == 3
+
+        assert dump_flags() == flags_before
+
+        # Existing flags are skipped.
+        with open(path, newline='') as f:
+            assert import_flags(f, fmt=fmt) == 3
+
+        assert dump_flags() == flags_before
+
+    path = str(tmp_path / 'flags.csv')
+
+    command_run('siteflags_export', args=[path, '--format', 'csv'])
+    assert capsys.readouterr().err == 'Flags exported: 3\n'
+
+    with open(path) as f:
+        assert f.readline().strip() == 'content_type,object_id,user_id,status,note,time_created'
+        assert f.readline().startswith('testapp.')
+
+    flag_model.objects.all().delete()
+    command_run('siteflags_import', args=[path])
+    assert capsys.readouterr().out == 'Flags processed: 3\n'
+    assert dump_flags() == flags_before
+    assert article.is_flagged(status=1)
+
+    # Counters are updated for flags written.
+    enable_counters()
+    article.remove_flag()
+
+    with open(path, newline='') as f:
+        assert import_flags(f) == 3
+
+    assert article.is_flagged() == 2
+    assert comment.is_flagged() == 1
+    assert FlagCounter.objects.filter(count__gt=1).count() == 0
+
+    # Duplicates in the same chunk are counted once.
+    with open(path) as f:
+        lines = f.readlines()
+
+    with open(path, 'a') as f:
+        f.write(lines[1])
+
+    article.remove_flag()
+    comment.remove_flag()
+
+    with open(path, newline='') as f:
+        assert import_flags(f) == 4
+
+    assert article.is_flagged() == 2
+    assert comment.is_flagged() == 1
+
+
+def test_transfer_copy(user, user_create, create_article, tmp_path, enable_counters, dump_flags):
+    from django.db import connection
+    from siteflags.transfer import export_flags, import_flags, write_flags_copy
+
+    flag_model = get_flag_model()
+
+    if connection.vendor != 'postgresql':
+        with pytest.raises(ValueError):
+            write_flags_copy(flag_model, [])
+
+        pytest.skip('COPY is only supported for PostgreSQL. Use SITEFLAGS_TEST_DATABASE.')
+
+    article = create_article()
+    article.set_flag(user, status=1, note='one, "quoted"')
+    article.set_flag(user)
+    article.set_flag(user_create())
+
+    flags_before = dump_flags()
+    path = tmp_path / 'flags.csv'
+
+    with open(path, 'w', newline='') as f:
+        export_flags(f)
+
+    flag_model.objects.all().delete()
+    enable_counters()
+
+    for _ in range(2):  # Existing flags are skipped.
+        with open(path, newline='') as f:
+            assert import_flags(f, chunk_size=2, copy=True) == 3
+
+    assert dump_flags() == flags_before
+    assert article.is_flagged() == 3
+
+
+def test_migrations(check_migrations):
+    assert check_migrations('siteflags')
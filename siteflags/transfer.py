@@ -0,0 +1,283 @@
+import csv
+import json
+from io import StringIO
+from typing import TextIO, Callable, Iterator, Dict, List, Optional, Any
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models.constants import OnConflict
+from django.utils.dateparse import parse_datetime
+
+from . import settings
+from .buffer import exclude_existing
+from .cache import get_flags_cache
+from .utils import get_flag_model
+
+if False:  # pragma: nocover
+    from .models import FlagBase  # noqa
+
+FIELDS = ('content_type', 'object_id', 'user_id', 'status', 'note', 'time_created')
+"""Fields of exported flags. Content types are represented by natural keys: `app_label.model`."""
+
+FORMATS = ('csv', 'jsonl')
+
+TypeProgress = Optional[Callable[[int], None]]
+
+
+def export_flags(stream: TextIO, *, fmt: str = 'csv', chunk_size: int = 5000, progress: TypeProgress = None) -> int:
+    """Writes all flags into the given stream. Returns a number of flags exported.
+
+    Flags are streamed from DB (using server-side cursors where supported)
+    so that memory consumption does not depend on flags number.
+
+    :param stream: Text stream to write into.
+    :param fmt: Format: csv, jsonl
+    :param chunk_size: Number of flags to fetch from DB at once (also a progress reporting step).
+    :param progress: Callable to be called with a total number of flags exported after every chunk.
+
+    """
+    flags = get_flag_model().objects.order_by().values_list(
+        'content_type_id', *FIELDS[1:]).iterator(chunk_size=chunk_size)
+
+    content_types = {}
+
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(FIELDS)
+
+        def write(row: List[Any]):
+            row[5] = row[5].isoformat()
+            writer.writerow(row)
+
+    else:
+        def write(row: List[Any]):
+            row[5] = row[5].isoformat()
+            stream.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False))
+            stream.write('\n')
+
+    exported = 0
+
+    for row in flags:
+        row = list(row)
+        content_type_id = row[0]
+        content_type = content_types.get(content_type_id)
+
+        if content_type is None:
+            content_type = ContentType.objects.get_for_id(content_type_id)
+            content_type = content_types[content_type_id] = f'{content_type.app_label}.{content_type.model}'
+
+        row[0] = content_type
+        write(row)
+        exported += 1
+
+        if progress and not exported % chunk_size:
+            progress(exported)
+
+    if progress and exported % chunk_size:
+        progress(exported)
+
+    return exported
+
+
+def import_flags(
+        stream: TextIO,
+        *,
+        fmt: str = 'csv',
+        chunk_size: int = 5000,
+        copy: bool = False,
+        progress: TypeProgress = None
+
+) -> int:
+    """Reads flags from the given stream and writes them into DB in chunks,
+    skipping existing ones. Returns a number of flags processed.
+
+    Flag counters (if enabled) are updated for flags actually written.
+
+    :param stream: Text stream to read from (see `export_flags()`).
+    :param fmt: Format: csv, jsonl
+    :param chunk_size: Number of flags to write at once.
+    :param copy: Use COPY (PostgreSQL only) to pass flags into DB.
+    :param progress: Callable to be called with a total number of flags processed after every chunk.
+
+    """
+    flag_model = get_flag_model()
+
+    processed = 0
+    chunk = []
+
+    for record in read_records(stream, fmt=fmt):
+        chunk.append(record)
+
+        if len(chunk) == chunk_size:
+            write_records(flag_model, chunk, copy=copy)
+            processed += len(chunk)
+            chunk = []
+
+            if progress:
+                progress(processed)
+
+    if chunk:
+        write_records(flag_model, chunk, copy=copy)
+        processed += len(chunk)
+
+        if progress:
+            progress(processed)
+
+    if processed:
+        flags_cache = get_flags_cache()
+
+        if flags_cache:
+            flags_cache.invalidate_all()
+
+    return processed
+
+
+def read_records(stream: TextIO, *, fmt: str) -> Iterator[Dict[str, Any]]:
+    """Yields flags records (dictionaries) read from the given stream.
+
+    :param stream:
+    :param fmt: Format: csv, jsonl
+
+    """
+    if fmt == 'csv':
+        records = csv.DictReader(stream)
+
+    else:
+        records = (json.loads(line) for line in stream if line.strip())
+
+    content_types = {}
+
+    for record in records:
+        content_type = record['content_type']
+        content_type_id = content_types.get(content_type)
+
+        if content_type_id is None:
+            app_label, _, model = content_type.partition('.')
+            content_type_id = content_types[content_type] = ContentType.objects.get_by_natural_key(
+                app_label, model).id
+
+        status = record['status']
+
+        yield {
+            'content_type_id': content_type_id,
+            'object_id': int(record['object_id']),
+            'user_id': int(record['user_id']),
+            'status': None if status in (None, '') else int(status),
+            'note': record['note'] or '',
+            'time_created': parse_datetime(record['time_created']),
+        }
+
+
+def write_records(flag_model, records: List[Dict[str, Any]], *, copy: bool):
+    """Writes flags records into DB skipping existing ones, updating flag counters if enabled.
+
+    :param flag_model:
+    :param records:
+    :param copy: Use COPY (PostgreSQL only) to pass flags into DB.
+
+    """
+    from .models import FlagCounter
+
+    # Skip duplicates (e.g. in legacy dumps) not to count them twice. The first one wins.
+    flags = {}
+
+    for record in records:
+        key = (record['content_type_id'], record['object_id'], record['user_id'], record['status'])
+
+        if key not in flags:
+            flags[key] = flag_model(**record)
+
+    flags = list(flags.values())
+
+    with transaction.atomic(using=flag_model.objects.db):
+
+        if settings.COUNTERS:
+            # Counters are only to be updated for flags actually inserted.
+            flags = exclude_existing(flags)
+
+        if copy:
+            write_flags_copy(flag_model, flags)
+
+        else:
+            write_flags_bulk(flag_model, flags)
+
+        if settings.COUNTERS:
+            FlagCounter.count_flags(flags)
+
+
+def write_flags_bulk(flag_model, flags: List['FlagBase']):
+    """Writes flags into DB in bulk ignoring conflicts.
+
+    Unlike bulk_create() this keeps flags creation time, since raw inserts
+    (as used by fixtures loading) don't apply `auto_now_add`.
+
+    :param flag_model:
+    :param flags:
+
+    """
+    if not flags:
+        return
+
+    manager = flag_model._base_manager
+    connection = connections[manager.db]
+    fields = [field for field in flag_model._meta.concrete_fields if not field.primary_key]
+    batch_size = max(connection.ops.bulk_batch_size(fields, flags), 1)
+
+    for idx in range(0, len(flags), batch_size):
+        manager._insert(flags[idx:idx + batch_size], fields=fields, raw=True, on_conflict=OnConflict.IGNORE)
+
+
+def write_flags_copy(flag_model, flags: List['FlagBase']):
+    """Writes flags into DB using PostgreSQL COPY into a temporary table
+    and INSERT ... ON CONFLICT DO NOTHING from it.
+
+    :param flag_model:
+    :param flags:
+
+    """
+    connection = connections[flag_model.objects.db]
+
+    if connection.vendor != 'postgresql':
+        raise ValueError('COPY is only supported for PostgreSQL')
+
+    if not flags:
+        return
+
+    opts = flag_model._meta
+    fields = ('content_type', 'object_id', 'user', 'status', 'note', 'time_created')
+    columns = ', '.join(connection.ops.quote_name(opts.get_field(field).column) for field in fields)
+
+    table = connection.ops.quote_name(opts.db_table)
+    table_tmp = connection.ops.quote_name(f'{opts.db_table}_import')
+
+    data = StringIO()
+    writer = csv.writer(data)
+
+    for flag in flags:
+        writer.writerow([
+            flag.content_type_id,
+            flag.object_id,
+            flag.user_id,
+            '' if flag.status is None else flag.status,
+            flag.note,
+            flag.time_created.isoformat(),
+        ])
+
+    data.seek(0)
+    copy_sql = f'COPY {table_tmp} ({columns}) FROM STDIN WITH (FORMAT csv)'
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {table_tmp} AS SELECT {columns} FROM {table} WITH NO DATA')
+
+        raw_cursor = cursor.cursor
+
+        if hasattr(raw_cursor, 'copy_expert'):  # psycopg2
+            raw_cursor.copy_expert(copy_sql, data)
+
+        else:  # psycopg 3
+            with raw_cursor.copy(copy_sql) as copy:
+                copy.write(data.getvalue())
+
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {table_tmp} ON CONFLICT DO NOTHING')
+        cursor.execute(f'TRUNCATE {table_tmp}')
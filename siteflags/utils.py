@@ -1,5 +1,11 @@
-from typing import Type
+from typing import Type, Dict, Union, Sequence
 
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import request_started
+from django.db import DatabaseError
+from django.db.models import Model
 from etc.toolbox import get_model_class_from_settings
 
 from siteflags import settings
@@ -7,7 +13,151 @@ from siteflags import settings
 if False:  # pragma: nocover
     from .models import Flag  # noqa
 
+WARM_DISPATCH_UID = 'siteflags_warm_content_types'
+
+_CONTENT_TYPES: Dict[str, Dict[Type[Model], int]] = {}
+"""Content types IDs indexed by DB aliases and model classes."""
+
 
 def get_flag_model() -> Type['Flag']:
     """Returns the Flag model, set for the project."""
     return get_model_class_from_settings(settings, 'MODEL_FLAG')
+
+
+def get_content_type_id(model: Union[Model, Type[Model]], *, for_concrete_model: bool = True) -> int:
+    """Returns content type ID for the given model (class or instance).
+
+    IDs are memoized (by DB aliases) for the lifetime of the process and are
+    available without DB hits after content types warming (see `warm_content_types()`).
+
+    :param model: Model class or instance.
+    :param for_concrete_model: Return content type of a concrete model for proxy models.
+
+    """
+    model = _get_target_model(model, for_concrete_model=for_concrete_model)
+    memo = _get_memo()
+
+    content_type_id = memo.get(model)
+
+    if content_type_id is None:
+        content_type_id = ContentType.objects.get_for_model(model, for_concrete_model=False).id
+        memo[model] = content_type_id
+
+    return content_type_id
+
+
+def get_content_types_ids(
+        models: Sequence[Type[Model]],
+        *,
+        for_concrete_models: bool = True
+
+) -> Dict[Type[Model], int]:
+    """Returns a dictionary of content types IDs indexed by the given model classes.
+
+    :param models: Model classes.
+    :param for_concrete_models: Return content types of concrete models for proxy models.
+
+    """
+    result = {}
+    missing = {}
+    memo = _get_memo()
+
+    for model in models:
+        target = _get_target_model(model, for_concrete_model=for_concrete_models)
+        content_type_id = memo.get(target)
+
+        if content_type_id is None:
+            missing[model] = target
+        else:
+            result[model] = content_type_id
+
+    if missing:
+        content_types = ContentType.objects.get_for_models(*set(missing.values()), for_concrete_models=False)
+
+        for model, target in missing.items():
+            content_type_id = content_types[target].id
+            memo[target] = content_type_id
+            result[model] = content_type_id
+
+    return result
+
+
+async def aget_content_type_id(model: Union[Model, Type[Model]], *, for_concrete_model: bool = True) -> int:
+    """Asynchronous version of `get_content_type_id()`.
+
+    :param model: Model class or instance.
+    :param for_concrete_model: Return content type of a concrete model for proxy models.
+
+    """
+    content_type_id = _get_memo().get(_get_target_model(model, for_concrete_model=for_concrete_model))
+
+    if content_type_id is None:
+        content_type_id = await sync_to_async(get_content_type_id)(model, for_concrete_model=for_concrete_model)
+
+    return content_type_id
+
+
+async def aget_content_types_ids(
+        models: Sequence[Type[Model]],
+        *,
+        for_concrete_models: bool = True
+
+) -> Dict[Type[Model], int]:
+    """Asynchronous version of `get_content_types_ids()`.
+
+    :param models: Model classes.
+    :param for_concrete_models: Return content types of concrete models for proxy models.
+
+    """
+    memo = _get_memo()
+
+    if all(_get_target_model(model, for_concrete_model=for_concrete_models) in memo for model in models):
+        return get_content_types_ids(models, for_concrete_models=for_concrete_models)
+
+    return await sync_to_async(get_content_types_ids)(models, for_concrete_models=for_concrete_models)
+
+
+def _get_memo() -> Dict[Type[Model], int]:
+    # Content types may differ between databases, as does ContentType cache.
+    return _CONTENT_TYPES.setdefault(ContentType.objects.db, {})
+
+
+def _get_target_model(model: Union[Model, Type[Model]], *, for_concrete_model: bool) -> Type[Model]:
+    opts = model._meta
+    return opts.concrete_model if for_concrete_model else opts.model
+
+
+def warm_content_types():
+    """Resolves and memoizes content types IDs for all models with flags at once."""
+    from .models import ModelWithFlag
+
+    get_content_types_ids(
+        [model for model in apps.get_models() if issubclass(model, ModelWithFlag)],
+        for_concrete_models=False,
+    )
+
+
+def warm_content_types_on_request(**kwargs):
+    """Warms content types on the first request (not to query DB on application start).
+
+    Used as a `request_started` signal handler, which is disconnected afterwards.
+
+    """
+    request_started.disconnect(dispatch_uid=WARM_DISPATCH_UID)
+
+    try:
+        warm_content_types()
+
+    except DatabaseError:
+        # DB may be unavailable at the moment or not yet migrated.
+        # Content types will be resolved on demand.
+        pass
+
+
+def clear_content_types(**kwargs):
+    """Clears memoized content types IDs.
+
+    Could be used as a signal handler.
+
+    """
+    _CONTENT_TYPES.clear()